@@ -0,0 +1,78 @@
+import threading
+from eth_utils import to_checksum_address
+from core import ERC20_ABI
+
+# 授权额度账本: 批量读取当前授权额度，并根据已发送的交易在本地更新，
+# 只有额度不足时才发送approve交易
+
+MAX_UINT256 = 2 ** 256 - 1
+
+def _key(owner, token_address, spender):
+    return owner.lower(), token_address.lower(), spender.lower()
+
+class AllowanceLedger:
+    def __init__(self, web3, approve_max=False):
+        self.web3 = web3
+        self.approve_max = approve_max
+        self._lock = threading.Lock()
+        self._allowances = {}
+
+    def load_snapshot(self, snapshot):
+        with self._lock:
+            self._allowances.update(snapshot.allowances)
+
+    def known(self, owner, token_address, spender):
+        with self._lock:
+            return self._allowances.get(_key(owner, token_address, spender))
+
+    def set(self, owner, token_address, spender, amount):
+        with self._lock:
+            self._allowances[_key(owner, token_address, spender)] = amount
+
+    def allowance(self, owner, token_address, spender):
+        amount = self.known(owner, token_address, spender)
+        if amount is None:
+            token_contract = self.web3.eth.contract(address=to_checksum_address(token_address), abi=ERC20_ABI)
+            amount = token_contract.functions.allowance(to_checksum_address(owner), to_checksum_address(spender)).call()
+            self.set(owner, token_address, spender, amount)
+        return amount
+
+    async def allowance_async(self, owner, token_address, spender, async_web3):
+        amount = self.known(owner, token_address, spender)
+        if amount is None:
+            token_contract = async_web3.eth.contract(address=to_checksum_address(token_address), abi=ERC20_ABI)
+            amount = await token_contract.functions.allowance(to_checksum_address(owner), to_checksum_address(spender)).call()
+            self.set(owner, token_address, spender, amount)
+        return amount
+
+    def needs_approval(self, owner, token_address, spender, amount):
+        # 读取额度失败时按需要授权处理，和原来每次都授权的行为一致
+        try:
+            return self.allowance(owner, token_address, spender) < amount
+        except Exception:
+            return True
+
+    async def needs_approval_async(self, owner, token_address, spender, amount, async_web3):
+        try:
+            return await self.allowance_async(owner, token_address, spender, async_web3) < amount
+        except Exception:
+            return True
+
+    def approval_amount(self, amount):
+        # 一次性授权最大额度时，之后同一钱包/代币不再需要授权
+        return MAX_UINT256 if self.approve_max else amount
+
+    def record_approval(self, owner, token_address, spender, amount):
+        self.set(owner, token_address, spender, amount)
+
+    def record_spend(self, owner, token_address, spender, amount):
+        # 最大额度授权在转账时不会减少
+        with self._lock:
+            key = _key(owner, token_address, spender)
+            current = self._allowances.get(key)
+            if current is not None and current != MAX_UINT256:
+                self._allowances[key] = max(current - amount, 0)
+
+    def invalidate(self, owner, token_address, spender):
+        with self._lock:
+            self._allowances.pop(_key(owner, token_address, spender), None)
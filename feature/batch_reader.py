@@ -0,0 +1,100 @@
+# JSON-RPC批量读取: 把一轮需要的所有eth_getBalance和ERC-20 balanceOf/allowance
+# 打包成少量批量请求，循环中从快照读取余额而不是每次都请求节点
+
+BALANCE_OF_SELECTOR = "0x70a08231"
+ALLOWANCE_SELECTOR = "0xdd62ed3e"
+# 节点不支持某个方法时的错误码和报错关键字，各家节点的措辞不同
+METHOD_NOT_FOUND_KEYWORDS = ("-32601", "method not found", "does not exist", "not supported", "unsupported method")
+
+def is_method_not_supported(error):
+    # 只有节点明确表示不支持该方法时返回True；超时、限流等临时错误返回False
+    message = str(error).lower()
+    return any(keyword in message for keyword in METHOD_NOT_FOUND_KEYWORDS)
+
+def _encode_address(address):
+    return address.lower().replace("0x", "").rjust(64, "0")
+
+def _decode_uint(result):
+    if result in (None, "0x"):
+        return 0
+    return int(result, 16)
+
+class BalanceSnapshot:
+    def __init__(self, token_addresses=(), allowance_spenders=(), block="latest"):
+        self.token_addresses = [token.lower() for token in token_addresses]
+        self.allowance_spenders = [spender.lower() for spender in allowance_spenders]
+        self.block = block
+        self.eth_balances = {}
+        self.token_balances = {}
+        self.allowances = {}
+
+    def eth_balance(self, address):
+        return self.eth_balances[address.lower()]
+
+    def token_balance(self, address, token_address):
+        return self.token_balances[(address.lower(), token_address.lower())]
+
+    def allowance(self, address, token_address, spender):
+        return self.allowances[(address.lower(), token_address.lower(), spender.lower())]
+
+class BatchReader:
+    def __init__(self, transport, chunk_size=100, timeout=30):
+        # transport: transport.EndpointPool，传入单个RPC URL时自动创建只有一个节点的连接池
+        if chunk_size < 1:
+            raise ValueError("批量请求大小必须至少为1")
+        if isinstance(transport, str):
+            from transport import EndpointPool
+            transport = EndpointPool([transport], timeout=timeout)
+        self.transport = transport
+        self.chunk_size = int(chunk_size)
+
+    def _block_param(self, block):
+        return hex(block) if isinstance(block, int) else block
+
+    def execute(self, calls):
+        # calls: [(method, params), ...]，按顺序返回每个调用的原始结果
+        results = []
+        for start in range(0, len(calls), self.chunk_size):
+            chunk = calls[start:start + self.chunk_size]
+            payload = [
+                {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+                for request_id, (method, params) in enumerate(chunk)
+            ]
+            data = self.transport.post_json(payload)
+            if not isinstance(data, list):
+                raise ValueError(f"节点不支持批量请求: {data}")
+
+            responses = {item.get("id"): item for item in data}
+            for request_id, (method, _) in enumerate(chunk):
+                item = responses.get(request_id)
+                if item is None:
+                    raise ValueError(f"批量请求缺少 {method} 的响应")
+                if "error" in item:
+                    raise ValueError(f"批量请求 {method} 失败: {item['error']}")
+                results.append(item.get("result"))
+        return results
+
+    def refresh(self, snapshot, addresses):
+        block = self._block_param(snapshot.block)
+        calls = []
+        keys = []
+        for address in addresses:
+            owner = address.lower()
+            calls.append(("eth_getBalance", [address, block]))
+            keys.append((snapshot.eth_balances, owner))
+            for token in snapshot.token_addresses:
+                data = BALANCE_OF_SELECTOR + _encode_address(owner)
+                calls.append(("eth_call", [{"to": token, "data": data}, block]))
+                keys.append((snapshot.token_balances, (owner, token)))
+                for spender in snapshot.allowance_spenders:
+                    data = ALLOWANCE_SELECTOR + _encode_address(owner) + _encode_address(spender)
+                    calls.append(("eth_call", [{"to": token, "data": data}, block]))
+                    keys.append((snapshot.allowances, (owner, token, spender)))
+
+        for (table, key), result in zip(keys, self.execute(calls)):
+            table[key] = _decode_uint(result)
+        return snapshot
+
+    def snapshot(self, addresses, token_addresses=(), allowance_spenders=(), block="latest"):
+        snapshot = BalanceSnapshot(token_addresses, allowance_spenders, block)
+        return self.refresh(snapshot, addresses)
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+# 区块时钟: 一个后台线程每隔poll_interval读取一次最新区块的高度和时间戳，
+# now()用最近区块的时间戳加上本地经过的时间估算链上当前时间，不访问节点。
+# 每笔交易在构建时用deadline()取新的截止时间；按区块缓存的服务(手续费、报价、收据)也从这里读取当前区块高度
+
+DEADLINE_SECONDS = 300
+IDLE_TIMEOUT = 30  # 超过这段时间没有读取时停止后台轮询，下次读取时自动重新启动
+
+class BlockClock:
+    def __init__(self, batch_reader, poll_interval=1.0, deadline_seconds=DEADLINE_SECONDS):
+        self.batch_reader = batch_reader
+        self.poll_interval = poll_interval
+        self.deadline_seconds = deadline_seconds
+        self._lock = threading.Lock()
+        self._number = None
+        self._timestamp = None
+        self._seen_at = 0
+        self._last_read = 0
+        self._thread = None
+
+    def _fetch(self):
+        block = self.batch_reader.execute([("eth_getBlockByNumber", ["latest", False])])[0]
+        return int(block["number"], 16), int(block["timestamp"], 16)
+
+    def _store(self, number, timestamp):
+        with self._lock:
+            # 多个节点之间高度可能略有差异，不回退到更旧的区块
+            if self._number is not None and number <= self._number:
+                return
+            self._number = number
+            self._timestamp = timestamp
+            self._seen_at = time.monotonic()
+
+    def refresh(self):
+        # 立即读取一次最新区块，返回区块高度
+        self._store(*self._fetch())
+        return self._number
+
+    async def refresh_async(self):
+        return await asyncio.to_thread(self.refresh)
+
+    def _touch(self):
+        with self._lock:
+            self._last_read = time.monotonic()
+            restarted = self._thread is None
+            if restarted:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if restarted:
+            # 第一次读取或空闲停止后重新启动时，缓存的区块可能已经很旧，先同步读取一次再返回
+            self.refresh()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if time.monotonic() - self._last_read > IDLE_TIMEOUT:
+                    self._thread = None
+                    return
+            try:
+                self.refresh()
+            except Exception:
+                # 节点临时错误时继续使用上一个区块推算时间
+                pass
+            time.sleep(self.poll_interval)
+
+    def block_number(self):
+        self._touch()
+        return self._number
+
+    def now(self):
+        # 链上当前时间(秒)的估计值
+        self._touch()
+        with self._lock:
+            return self._timestamp + (time.monotonic() - self._seen_at)
+
+    def deadline(self, seconds=None):
+        return int(self.now()) + (self.deadline_seconds if seconds is None else seconds)
@@ -0,0 +1,96 @@
+import sys
+import time
+from eth_abi import encode
+from eth_utils import function_abi_to_4byte_selector
+
+# 调用数据模板: 路由器和ERC-20调用里路径、接收地址、代币地址等参数对同一个钱包/代币是固定的，
+# 第一次调用时用eth_abi完整编码一次作为模板，之后只把金额、截止时间等uint参数写入对应的32字节位置
+
+TEMPLATE_CACHE_SIZE = 4096
+UINT256_LIMIT = 2 ** 256
+
+def _is_uint(abi_type):
+    return abi_type.startswith("uint") and "[" not in abi_type
+
+class CalldataTemplate:
+    def __init__(self, function_abi, args):
+        self.name = function_abi["name"]
+        types = [item["type"] for item in function_abi["inputs"]]
+        self.uint_positions = [index for index, abi_type in enumerate(types) if _is_uint(abi_type)]
+        # 所有参数的头部都是32字节: 静态类型是值本身，动态类型(address[])是偏移量，
+        # 所以第index个uint参数总是在4 + 32 * index字节处
+        placeholder = [0 if index in self.uint_positions else arg for index, arg in enumerate(args)]
+        self.prefix = function_abi_to_4byte_selector(function_abi) + encode(types, placeholder)
+        self.offsets = [4 + 32 * index for index in self.uint_positions]
+
+    def encode(self, uint_values):
+        data = bytearray(self.prefix)
+        for offset, value in zip(self.offsets, uint_values):
+            if not 0 <= value < UINT256_LIMIT:
+                raise ValueError(f"{self.name} 参数超出uint256范围: {value}")
+            data[offset:offset + 32] = value.to_bytes(32, "big")
+        return "0x" + data.hex()
+
+class CalldataEncoder:
+    def __init__(self, *abis):
+        self.functions = {entry["name"]: entry for abi in abis for entry in abi if entry.get("type") == "function"}
+        self._templates = {}
+
+    def _template_key(self, function_abi, args):
+        key = [function_abi["name"]]
+        for item, arg in zip(function_abi["inputs"], args):
+            if not _is_uint(item["type"]):
+                key.append(tuple(address.lower() for address in arg) if isinstance(arg, (list, tuple)) else arg.lower())
+        return tuple(key)
+
+    def encode(self, function_name, *args):
+        # 参数顺序与合约函数一致，返回十六进制调用数据，可直接作为交易的data字段
+        function_abi = self.functions[function_name]
+        if len(args) != len(function_abi["inputs"]):
+            raise TypeError(f"{function_name} 需要 {len(function_abi['inputs'])} 个参数，传入了 {len(args)} 个")
+        key = self._template_key(function_abi, args)
+        template = self._templates.get(key)
+        if template is None:
+            if len(self._templates) >= TEMPLATE_CACHE_SIZE:
+                self._templates.clear()
+            template = CalldataTemplate(function_abi, args)
+            self._templates[key] = template
+        return template.encode([args[index] for index in template.uint_positions])
+
+def benchmark(count=5000):
+    # 比较build_transaction和模板编码构建交易的速度，并检查两者生成的data完全相同
+    from web3 import Web3
+    from core import CHAIN_ID, ERC20_ABI, ROUTER_ABI, UNISWAP_V2_ROUTER_ADDRESS, WETH_ADDRESS, KNOWN_TOKENS
+
+    web3 = Web3()
+    router = web3.eth.contract(address=UNISWAP_V2_ROUTER_ADDRESS, abi=ROUTER_ABI)
+    token = web3.eth.contract(address=KNOWN_TOKENS["NXS"], abi=ERC20_ABI)
+    encoder = CalldataEncoder(ROUTER_ABI, ERC20_ABI)
+    account = Web3.to_checksum_address("0x1bee0b233db0953fa4305fc8975ad44ab40a762a")
+    path = [WETH_ADDRESS, KNOWN_TOKENS["NXS"]]
+    base = {"from": account, "gas": 200000, "gasPrice": 10 ** 9, "nonce": 0, "chainId": CHAIN_ID}
+    cases = {
+        "swapExactETHForTokens": (router, lambda i: (i, path, account, 1700000000 + i)),
+        "swapExactTokensForETH": (router, lambda i: (10 ** 18 + i, i, path[::-1], account, 1700000000 + i)),
+        "addLiquidityETH": (router, lambda i: (path[1], 10 ** 18 + i, i, i, account, 1700000000 + i)),
+        "removeLiquidityETH": (router, lambda i: (path[1], 10 ** 18 + i, i, i, account, 1700000000 + i)),
+        "approve": (token, lambda i: (UNISWAP_V2_ROUTER_ADDRESS, 10 ** 18 + i)),
+    }
+    print(f"{'函数':<24}{'build_transaction':>20}{'模板':>14}{'加速':>8}")
+    for name, (contract, make_args) in cases.items():
+        # 交易字段都已给出，build_transaction不需要访问节点，两边构建的是同样的交易字典
+        start = time.perf_counter()
+        for i in range(count):
+            expected = getattr(contract.functions, name)(*make_args(i)).build_transaction({**base, "value": 0})
+        build_rate = count / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(count):
+            transaction = {**base, "to": contract.address, "value": 0, "data": encoder.encode(name, *make_args(i))}
+        template_rate = count / (time.perf_counter() - start)
+
+        assert transaction["data"] == expected["data"], name
+        print(f"{name:<24}{build_rate:>17.0f}/秒{template_rate:>11.0f}/秒{template_rate / build_rate:>7.1f}x")
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from batch_reader import is_method_not_supported
+
+# 手续费预言机: 所有钱包和操作共享，每个区块最多读取一次eth_feeHistory(或eth_gasPrice)，
+# 支持legacy和EIP-1559(type 2)交易，替换交易时一次性提高到节点要求的最低涨幅
+
+REPLACEMENT_BUMP_PERCENT = 10  # geth交易池默认要求替换交易至少提高10%
+FEE_HISTORY_RETRY_SECONDS = 60  # auto模式下eth_feeHistory临时失败后先使用gasPrice，过这段时间再重新尝试
+
+def _bump_value(value, percent):
+    return value * (100 + percent) // 100 + 1
+
+class FeeOracle:
+    def __init__(self, web3, mode="auto", block_time=1.0, priority_percentile=50, base_fee_multiplier=2, bump_percent=REPLACEMENT_BUMP_PERCENT, block_clock=None):
+        # mode: "auto"自动检测, "legacy"或"eip1559"; 传入block_clock时按区块高度判断缓存是否过期，否则按block_time
+        if mode not in ("auto", "legacy", "eip1559"):
+            raise ValueError(f"未知的手续费模式: {mode}")
+        self.web3 = web3
+        self.mode = mode
+        self.block_time = block_time
+        self.priority_percentile = priority_percentile
+        self.base_fee_multiplier = base_fee_multiplier
+        self.bump_percent = bump_percent
+        self.block_clock = block_clock
+        self._lock = threading.Lock()
+        self._fees = None
+        self._checked_at = 0
+        self._block = None
+        self._inflight = None
+        self._history_retry_at = 0
+
+    def _current_block(self):
+        return self.block_clock.block_number() if self.block_clock is not None else None
+
+    def _is_fresh(self, block):
+        if self._fees is None:
+            return False
+        if block is not None:
+            return self._block == block
+        return time.monotonic() - self._checked_at < self.block_time
+
+    def _use_history(self):
+        return self.mode == "eip1559" or (self.mode == "auto" and time.monotonic() >= self._history_retry_at)
+
+    def _history_failed(self, error=None):
+        # 节点明确不支持eth_feeHistory时才永久切换到legacy；其他错误或没有基础费用时本次使用gasPrice，冷却后重新尝试
+        if self.mode != "auto":
+            return
+        if error is not None and is_method_not_supported(error):
+            self.mode = "legacy"
+        else:
+            self._history_retry_at = time.monotonic() + FEE_HISTORY_RETRY_SECONDS
+
+    def _fees_from_history(self, history):
+        base_fees = history["baseFeePerGas"]
+        if not base_fees or not base_fees[-1]:
+            return None
+        rewards = [reward[0] for reward in history.get("reward") or [] if reward]
+        priority_fee = max(rewards) if rewards else 0
+        # baseFeePerGas的最后一项是下一个区块的基础费用
+        return {
+            "maxFeePerGas": base_fees[-1] * self.base_fee_multiplier + priority_fee,
+            "maxPriorityFeePerGas": priority_fee,
+        }
+
+    def _store(self, fees, block):
+        with self._lock:
+            self._fees = fees
+            self._checked_at = time.monotonic()
+            self._block = block
+        return dict(fees)
+
+    def fees(self):
+        # 返回可以直接展开到交易参数中的字典: {'gasPrice': ...}或{'maxFeePerGas': ..., 'maxPriorityFeePerGas': ...}
+        block = self._current_block()
+        with self._lock:
+            if self._is_fresh(block):
+                return dict(self._fees)
+        fees = None
+        if self._use_history():
+            try:
+                fees = self._fees_from_history(self.web3.eth.fee_history(1, "latest", [self.priority_percentile]))
+            except Exception as e:
+                if self.mode == "eip1559":
+                    raise
+                self._history_failed(e)
+            else:
+                if fees is None:
+                    self._history_failed()
+        if fees is None:
+            fees = {"gasPrice": self.web3.eth.gas_price}
+        return self._store(fees, block)
+
+    async def fees_async(self, async_web3):
+        # 区块时钟已在后台运行时block_number()直接返回缓存的高度，不访问节点
+        block = self._current_block()
+        with self._lock:
+            if self._is_fresh(block):
+                return dict(self._fees)
+        # 并发的钱包共用同一个正在进行的查询
+        loop = asyncio.get_running_loop()
+        if self._inflight is None or self._inflight[0] is not loop or self._inflight[1].done():
+            self._inflight = (loop, loop.create_task(self._fetch_async(async_web3, block)))
+        return dict(await asyncio.shield(self._inflight[1]))
+
+    async def _fetch_async(self, async_web3, block):
+        fees = None
+        if self._use_history():
+            try:
+                fees = self._fees_from_history(await async_web3.eth.fee_history(1, "latest", [self.priority_percentile]))
+            except Exception as e:
+                if self.mode == "eip1559":
+                    raise
+                self._history_failed(e)
+            else:
+                if fees is None:
+                    self._history_failed()
+        if fees is None:
+            fees = {"gasPrice": await async_web3.eth.gas_price}
+        return self._store(fees, block)
+
+    def _replacement(self, fees, current):
+        bumped = {key: _bump_value(value, self.bump_percent) for key, value in fees.items()}
+        if set(current) == set(bumped):
+            bumped = {key: max(value, current[key]) for key, value in bumped.items()}
+        if "maxFeePerGas" in bumped:
+            bumped["maxFeePerGas"] = max(bumped["maxFeePerGas"], bumped["maxPriorityFeePerGas"])
+        return bumped
+
+    def replacement_fees(self, fees):
+        # 替换交易: 每项费用至少提高bump_percent，如果当前市场价更高则使用市场价
+        return self._replacement(fees, self.fees())
+
+    async def replacement_fees_async(self, fees, async_web3):
+        return self._replacement(fees, await self.fees_async(async_web3))
+
+    def describe(self, fees):
+        if "gasPrice" in fees:
+            return f"{self.web3.from_wei(fees['gasPrice'], 'gwei')} gwei"
+        return f"{self.web3.from_wei(fees['maxFeePerGas'], 'gwei')} gwei (小费 {self.web3.from_wei(fees['maxPriorityFeePerGas'], 'gwei')} gwei)"
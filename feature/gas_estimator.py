@@ -0,0 +1,138 @@
+import atexit
+import json
+import os
+import threading
+import time
+from metadata import CACHE_DIR
+
+# Gas上限估算: 按(操作, 代币)记录最近交易实际消耗的gasUsed，
+# 没有记录时用eth_estimateGas估算一次，再乘以余量作为gas上限；统计保存在本地缓存中，
+# 有变化时最多每SAVE_INTERVAL秒写一次文件，退出时再写一次，收到收据时不直接写磁盘
+
+SAMPLE_WINDOW = 20
+OUT_OF_GAS_BUMP = 1.3
+SAVE_INTERVAL = 30
+
+class GasEstimator:
+    def __init__(self, chain_id, headroom=1.2, cache_path=None):
+        self.headroom = headroom
+        self.cache_path = cache_path or os.path.join(CACHE_DIR, f"gas_{chain_id}.json")
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.stats = {}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._load_cache()
+        atexit.register(self.flush)
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                self.stats = json.load(f)
+        except (OSError, ValueError):
+            self.stats = {}
+
+    def _save_cache(self, data):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.cache_path)
+
+    def _changed(self):
+        # 在锁内调用: 标记有变化，距离上次保存超过SAVE_INTERVAL时返回True，由调用方在锁外调用flush()
+        self._dirty = True
+        return time.monotonic() - self._saved_at >= SAVE_INTERVAL
+
+    def flush(self):
+        # 把未保存的变化写入缓存文件，例如定期保存或程序退出时；统计表的锁只在序列化时持有
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                self._saved_at = time.monotonic()
+                data = json.dumps(self.stats, indent=2)
+            self._save_cache(data)
+
+    def _key(self, operation, token_address):
+        return f"{operation}:{token_address.lower()}"
+
+    def _base(self, key):
+        entry = self.stats.get(key)
+        if not entry:
+            return None
+        values = entry.get("samples") or [entry.get("estimate", 0)]
+        return max(values + [entry.get("floor", 0)]) or None
+
+    def _limit_from(self, base):
+        return int(base * self.headroom)
+
+    def _store_estimate(self, key, estimate):
+        with self._lock:
+            self.stats.setdefault(key, {})["estimate"] = estimate
+            save = self._changed()
+        if save:
+            self.flush()
+
+    def limit(self, operation, token_address, estimate, fallback):
+        # estimate: 无参数函数，返回eth_estimateGas结果；估算失败时使用fallback
+        key = self._key(operation, token_address)
+        with self._lock:
+            base = self._base(key)
+        if base is None:
+            try:
+                base = estimate()
+            except Exception:
+                return fallback
+            self._store_estimate(key, base)
+        return self._limit_from(base)
+
+    async def limit_async(self, operation, token_address, estimate, fallback):
+        key = self._key(operation, token_address)
+        with self._lock:
+            base = self._base(key)
+        if base is None:
+            try:
+                base = await estimate()
+            except Exception:
+                return fallback
+            self._store_estimate(key, base)
+        return self._limit_from(base)
+
+    def record(self, operation, token_address, receipt, gas_limit=None):
+        key = self._key(operation, token_address)
+        gas_used = receipt["gasUsed"]
+        with self._lock:
+            entry = self.stats.setdefault(key, {})
+            if receipt["status"] == 1:
+                entry["samples"] = (entry.get("samples", []) + [gas_used])[-SAMPLE_WINDOW:]
+            elif gas_limit is not None and gas_used >= gas_limit * 0.98:
+                # 交易因gas上限不足而回滚
+                self._raise_floor(entry, gas_limit)
+            else:
+                return
+            save = self._changed()
+        if save:
+            self.flush()
+
+    def bump(self, operation, token_address, gas_limit):
+        # 发送时报out of gas: 提高gas上限而不是gas价格
+        key = self._key(operation, token_address)
+        with self._lock:
+            self._raise_floor(self.stats.setdefault(key, {}), gas_limit)
+            save = self._changed()
+        if save:
+            self.flush()
+
+    def _raise_floor(self, entry, gas_limit):
+        entry["floor"] = max(entry.get("floor", 0), int(gas_limit * OUT_OF_GAS_BUMP / self.headroom))
+
+    def receipt_callback(self, operation, token_address, gas_limit=None):
+        # 配合ReceiptTracker.track使用，不阻塞发送流程
+        def callback(future):
+            if not future.cancelled() and future.exception() is None:
+                self.record(operation, token_address, future.result(), gas_limit)
+        return callback
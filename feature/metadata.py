@@ -0,0 +1,98 @@
+import json
+import os
+from decimal import Decimal
+from eth_utils import to_checksum_address
+from core import ERC20_ABI, PAIR_ABI
+
+# 交易对和代币元数据注册表: token0/token1、decimals和symbol永远不会改变，
+# 首次批量读取后按链ID保存到本地缓存，之后直接从内存读取
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+def to_base_units(amount, decimals):
+    return int(Decimal(str(amount)) * (Decimal(10) ** decimals))
+
+def from_base_units(amount, decimals):
+    return Decimal(amount) / (Decimal(10) ** decimals)
+
+class MetadataRegistry:
+    def __init__(self, web3, multicall, chain_id, cache_path=None):
+        self.web3 = web3
+        self.multicall = multicall
+        self.cache_path = cache_path or os.path.join(CACHE_DIR, f"metadata_{chain_id}.json")
+        self.tokens = {}
+        self.pairs = {}
+        self._load_cache()
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+            self.tokens = data.get("tokens", {})
+            self.pairs = data.get("pairs", {})
+        except (OSError, ValueError):
+            self.tokens = {}
+            self.pairs = {}
+
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"tokens": self.tokens, "pairs": self.pairs}, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def load(self, token_addresses=(), pair_addresses=()):
+        # 先批量读取缺失的交易对，再读取所有缺失的代币(包括交易对中的代币)
+        missing_pairs = [to_checksum_address(pair) for pair in pair_addresses if pair.lower() not in self.pairs]
+        if missing_pairs:
+            contracts = [self.web3.eth.contract(address=pair, abi=PAIR_ABI) for pair in missing_pairs]
+            calls = [(contract, name, []) for contract in contracts for name in ("token0", "token1")]
+            results = self.multicall.call(calls)
+            for index, pair in enumerate(missing_pairs):
+                self.pairs[pair.lower()] = {"token0": results[index * 2], "token1": results[index * 2 + 1]}
+
+        # LP代币本身也是ERC-20，一起读取精度
+        wanted_tokens = [token.lower() for token in token_addresses]
+        for pair in pair_addresses:
+            pair_tokens = self.pairs[pair.lower()]
+            wanted_tokens += [pair.lower(), pair_tokens["token0"].lower(), pair_tokens["token1"].lower()]
+        missing_tokens = [to_checksum_address(token) for token in dict.fromkeys(wanted_tokens) if token not in self.tokens]
+        if missing_tokens:
+            contracts = [self.web3.eth.contract(address=token, abi=ERC20_ABI) for token in missing_tokens]
+            calls = [(contract, name, []) for contract in contracts for name in ("decimals", "symbol")]
+            results = self.multicall.call(calls, allow_failure=True)
+            for index, token in enumerate(missing_tokens):
+                decimals = results[index * 2]
+                self.tokens[token.lower()] = {
+                    "decimals": 18 if decimals is None else decimals,
+                    "symbol": results[index * 2 + 1] or "",
+                }
+
+        if missing_pairs or missing_tokens:
+            self._save_cache()
+
+    def register_pairs(self, pairs):
+        # pairs: {交易对地址: (token0, token1)}，例如来自PairCreated日志，不需要再查询交易对合约
+        missing = {pair.lower(): tokens for pair, tokens in pairs.items() if pair.lower() not in self.pairs}
+        for pair, (token0, token1) in missing.items():
+            self.pairs[pair] = {"token0": token0, "token1": token1}
+        if missing:
+            self._save_cache()
+
+    def pair(self, pair_address):
+        if pair_address.lower() not in self.pairs:
+            self.load(pair_addresses=[pair_address])
+        return self.pairs[pair_address.lower()]
+
+    def token(self, token_address):
+        if token_address.lower() not in self.tokens:
+            self.load(token_addresses=[token_address])
+        return self.tokens[token_address.lower()]
+
+    def decimals(self, token_address):
+        return self.token(token_address)["decimals"]
+
+    def symbol(self, token_address):
+        return self.token(token_address)["symbol"]
@@ -0,0 +1,140 @@
+from eth_abi import decode
+from eth_utils import to_checksum_address
+
+# Multicall3读取聚合: 把多个eth_call合并成一次aggregate3调用，所有结果来自同一个区块；
+# 链上没有部署Multicall3时退回到固定区块的逐个调用
+
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+# 单次aggregate3最多包含的调用数，调用很多时分成多次，避免超出节点的gas或响应大小限制
+MULTICALL_CHUNK_SIZE = 200
+
+multicall3_abi = '''
+[
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+'''
+
+def _decode_outputs(contract, fn_name, data):
+    outputs = contract.get_function_by_name(fn_name).abi["outputs"]
+    types = [output["type"] for output in outputs]
+    values = [
+        to_checksum_address(value) if abi_type == "address" else value
+        for abi_type, value in zip(types, decode(types, data))
+    ]
+    return values[0] if len(values) == 1 else values
+
+class Multicall:
+    def __init__(self, web3, address=MULTICALL3_ADDRESS, block_clock=None, chunk_size=MULTICALL_CHUNK_SIZE):
+        self.web3 = web3
+        self.block_clock = block_clock
+        self.chunk_size = int(chunk_size)
+        self.address = to_checksum_address(address)
+        self.contract = web3.eth.contract(address=self.address, abi=multicall3_abi)
+        self._available = None
+
+    def is_available(self):
+        if self._available is None:
+            try:
+                self._available = len(self.web3.eth.get_code(self.address)) > 0
+            except Exception:
+                self._available = False
+        return self._available
+
+    def call(self, calls, block_identifier=None, allow_failure=False):
+        # calls: [(contract, 函数名, 参数列表), ...]，按顺序返回解码后的结果
+        # allow_failure为True时，失败的调用返回None
+        if not self.is_available():
+            return self._call_each(calls, block_identifier, allow_failure)
+
+        payload = [
+            (contract.address, allow_failure, contract.encode_abi(fn_name, args=list(args)))
+            for contract, fn_name, args in calls
+        ]
+        if len(payload) > self.chunk_size and block_identifier is None:
+            # 分成多次调用时固定在同一个区块，所有结果仍然一致
+            block_identifier = self._current_block()
+        results = []
+        for start in range(0, len(payload), self.chunk_size):
+            chunk = payload[start:start + self.chunk_size]
+            results += self.contract.functions.aggregate3(chunk).call(block_identifier=block_identifier or "latest")
+        decoded = []
+        for (contract, fn_name, _), (success, return_data) in zip(calls, results):
+            try:
+                decoded.append(_decode_outputs(contract, fn_name, return_data) if success else None)
+            except Exception:
+                if not allow_failure:
+                    raise
+                decoded.append(None)
+        return decoded
+
+    def _current_block(self):
+        return self.block_clock.block_number() if self.block_clock is not None else self.web3.eth.block_number
+
+    def _call_each(self, calls, block_identifier=None, allow_failure=False):
+        # 逐个调用时固定在同一个区块，保证储备量和总供应量一致
+        if block_identifier is None:
+            block_identifier = self._current_block()
+        results = []
+        for contract, fn_name, args in calls:
+            try:
+                results.append(contract.get_function_by_name(fn_name)(*args).call(block_identifier=block_identifier))
+            except Exception:
+                if not allow_failure:
+                    raise
+                results.append(None)
+        return results
+
+PAIR_STATE_KEYS = ["reserves", "total_supply", "token0", "token1"]
+
+def _pair_state_calls(include_tokens):
+    names = ["getReserves", "totalSupply"]
+    if include_tokens:
+        names += ["token0", "token1"]
+    return names
+
+def read_pair_state(multicall, pair_contract, owners=(), block_identifier=None, include_tokens=True):
+    names = _pair_state_calls(include_tokens)
+    calls = [(pair_contract, name, []) for name in names]
+    calls += [(pair_contract, "balanceOf", [owner]) for owner in owners]
+    results = multicall.call(calls, block_identifier)
+    state = dict(zip(PAIR_STATE_KEYS, results[:len(names)]))
+    state["balances"] = dict(zip(owners, results[len(names):]))
+    return state
+
+def read_pair_states(multicall, pair_contracts, block_identifier=None, include_tokens=True):
+    # 一次调用读取多个交易对的状态
+    names = _pair_state_calls(include_tokens)
+    calls = [(pair_contract, name, []) for pair_contract in pair_contracts for name in names]
+    results = multicall.call(calls, block_identifier)
+    states = {}
+    for index, pair_contract in enumerate(pair_contracts):
+        values = results[index * len(names):(index + 1) * len(names)]
+        states[pair_contract.address] = dict(zip(PAIR_STATE_KEYS, values))
+    return states
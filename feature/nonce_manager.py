@@ -0,0 +1,139 @@
+import heapq
+import threading
+from collections import OrderedDict
+
+# 本地nonce分配器: 每个账户只从链上同步一次，之后在本地分配nonce，
+# 发送失败的nonce会被回收，只有节点报告nonce不连续或已发送的交易被丢弃时才重新同步；
+# 重新同步只会向前合并，已经分配给正在发送的交易的nonce不会被再次分配
+
+SENT_HISTORY_SIZE = 4096  # 记住最近发送的交易的(地址, nonce)，交易超时未上链时用来回收nonce
+
+def _hash_key(tx_hash):
+    if isinstance(tx_hash, (bytes, bytearray)):
+        return "0x" + bytes(tx_hash).hex()
+    return tx_hash.lower()
+
+class NonceManager:
+    def __init__(self, web3):
+        self.web3 = web3
+        self._lock = threading.Lock()
+        self._next_nonce = {}
+        self._released = {}
+        self._sent = OrderedDict()
+
+    def is_synced(self, address):
+        with self._lock:
+            return address in self._next_nonce
+
+    def seed(self, address, chain_nonce):
+        # 在锁内判断: 多个线程同时首次同步同一个账户时，后到的不会把nonce退回到别人已经取走的值以下
+        with self._lock:
+            if address not in self._next_nonce:
+                self._next_nonce[address] = chain_nonce
+                self._released[address] = []
+                return
+            self._next_nonce[address] = max(self._next_nonce[address], chain_nonce)
+            released = [nonce for nonce in self._released[address] if nonce >= chain_nonce]
+            heapq.heapify(released)
+            self._released[address] = released
+
+    def sync(self, address):
+        chain_nonce = self.web3.eth.get_transaction_count(address, "pending")
+        self.seed(address, chain_nonce)
+        return chain_nonce
+
+    async def sync_async(self, address, async_web3):
+        chain_nonce = await async_web3.eth.get_transaction_count(address, "pending")
+        self.seed(address, chain_nonce)
+        return chain_nonce
+
+    def _take(self, address):
+        released = self._released[address]
+        if released:
+            return heapq.heappop(released)
+        nonce = self._next_nonce[address]
+        self._next_nonce[address] = nonce + 1
+        return nonce
+
+    def allocate(self, address):
+        if not self.is_synced(address):
+            self.sync(address)
+        with self._lock:
+            return self._take(address)
+
+    async def allocate_async(self, address, async_web3):
+        if not self.is_synced(address):
+            await self.sync_async(address, async_web3)
+        with self._lock:
+            return self._take(address)
+
+    def release(self, address, nonce):
+        # 交易没有进入交易池，nonce可以重新分配
+        if nonce is None:
+            return
+        with self._lock:
+            if address not in self._next_nonce:
+                return
+            released = self._released[address]
+            if nonce == self._next_nonce[address] - 1:
+                self._next_nonce[address] = nonce
+                while released and max(released) == self._next_nonce[address] - 1:
+                    released.remove(self._next_nonce[address] - 1)
+                    heapq.heapify(released)
+                    self._next_nonce[address] -= 1
+            elif nonce < self._next_nonce[address] and nonce not in released:
+                heapq.heappush(released, nonce)
+
+    def sent(self, address, nonce, tx_hash):
+        with self._lock:
+            self._sent[_hash_key(tx_hash)] = (address, nonce)
+            if len(self._sent) > SENT_HISTORY_SIZE:
+                self._sent.popitem(last=False)
+
+    def transaction_dropped(self, tx_hash):
+        # 等待收据超时时调用: 交易既没有上链也不在交易池中时，它的nonce成了空缺，回收后下一笔交易补上
+        with self._lock:
+            entry = self._sent.pop(_hash_key(tx_hash), None)
+        if entry is None:
+            return
+        address, nonce = entry
+        if nonce < self.web3.eth.get_transaction_count(address, "latest"):
+            return
+        from web3.exceptions import TransactionNotFound
+        try:
+            self.web3.eth.get_transaction(tx_hash)
+            return
+        except TransactionNotFound:
+            pass
+        self.sync(address)
+        self.release(address, nonce)
+
+    def _send_error_kind(self, error):
+        message = str(error).lower()
+        if 'already known' in message:
+            return "known"
+        if 'nonce too low' in message:
+            return "low"
+        if 'nonce too high' in message:
+            return "high"
+        return None
+
+    def handle_send_error(self, address, nonce, error):
+        kind = self._send_error_kind(error)
+        if kind == "known":
+            # 同一笔交易已经在交易池中，nonce已被使用，不回收也不重新同步
+            return
+        if kind != "low":
+            self.release(address, nonce)
+        if kind is not None:
+            # 本地记录与链上不一致(其他程序发送了交易或交易被丢弃)，重新同步
+            self.sync(address)
+
+    async def handle_send_error_async(self, address, nonce, error, async_web3):
+        kind = self._send_error_kind(error)
+        if kind == "known":
+            return
+        if kind != "low":
+            self.release(address, nonce)
+        if kind is not None:
+            await self.sync_async(address, async_web3)
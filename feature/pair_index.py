@@ -0,0 +1,229 @@
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from eth_utils import to_checksum_address
+from metadata import CACHE_DIR
+
+# 交易对索引: 扫描UniswapV2工厂合约的PairCreated日志得到所有交易对，连同已扫描到的区块保存到本地缓存，
+# 之后启动只查询上次之后的新区块。首次扫描从工厂合约部署的区块开始(未配置时用eth_getCode二分查找)，
+# 把区块范围切成多段并行请求eth_getLogs，节点拒绝范围过大或结果过多的查询时把该段对半拆开重试，
+# 并记住节点能接受的段大小
+
+PAIR_CREATED_TOPIC = "0x0d3648bd0f6ba80134a33ba9275ac585d9d315f0ad8355cddefde31afa28d0e9"
+FACTORY_SELECTOR = "0xc45a0155"
+DEFAULT_CHUNK_SIZE = 5000
+MIN_CHUNK_SIZE = 16
+SCAN_WORKERS = 8
+# 各种节点对eth_getLogs范围或结果数量限制的报错关键字
+RANGE_ERROR_KEYWORDS = (
+    "block range", "range too", "too many", "too large", "more than", "limit", "exceed", "response size", "timeout", "413",
+)
+
+def _is_range_error(error):
+    # 超时和413也可能是单次查询的范围太大，拆小后重试
+    if not isinstance(error, (ValueError, ConnectionError)):
+        return False
+    message = str(error).lower()
+    return any(keyword in message for keyword in RANGE_ERROR_KEYWORDS)
+
+def _topic_address(topic):
+    return to_checksum_address("0x" + topic[-40:])
+
+class PairIndex:
+    def __init__(self, batch_reader, router_address, chain_id, factory_address=None, start_block=None,
+                 cache_path=None, workers=SCAN_WORKERS):
+        self.batch_reader = batch_reader
+        self.router_address = router_address
+        self.cache_path = cache_path or os.path.join(CACHE_DIR, f"pairs_{chain_id}.json")
+        self.workers = workers
+        self.start_block = start_block
+        self.factory_address = factory_address
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        # None表示还不知道从哪个区块开始扫描，首次更新时查找工厂合约的部署区块
+        self.last_block = None if start_block is None else start_block - 1
+        self.pairs = {}
+        self._lock = threading.Lock()
+        self._load_cache()
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        # 配置了不同的工厂合约时缓存作废，重新扫描
+        if self.factory_address is not None and data.get("factory", "").lower() != self.factory_address.lower():
+            return
+        self.factory_address = data.get("factory") or self.factory_address
+        self.chunk_size = data.get("chunk_size", DEFAULT_CHUNK_SIZE)
+        self.last_block = data.get("last_block", self.last_block)
+        self.pairs = {pair: tuple(tokens) for pair, tokens in data.get("pairs", {}).items()}
+
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "factory": self.factory_address,
+                "last_block": self.last_block,
+                "chunk_size": self.chunk_size,
+                "pairs": {pair: list(tokens) for pair, tokens in self.pairs.items()},
+            }, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def factory(self):
+        # 未配置工厂地址时从路由器的factory()读取一次，之后保存在缓存中
+        if self.factory_address is None:
+            result = self.batch_reader.execute([("eth_call", [{"to": self.router_address, "data": FACTORY_SELECTOR}, "latest"])])[0]
+            self.factory_address = _topic_address(result)
+        return self.factory_address
+
+    def _deployment_block(self, latest):
+        # 二分查找工厂合约代码第一次出现的区块；需要节点能查询历史状态(归档节点)，否则抛出异常，
+        # 这时需要在.env中设置PAIR_INDEX_START_BLOCK
+        def has_code(block):
+            code = self.batch_reader.execute([("eth_getCode", [self.factory(), hex(block)])])[0]
+            return code not in (None, "0x", "0x0")
+
+        if not has_code(latest):
+            raise ValueError(f"工厂合约 {self.factory()} 在区块 {latest} 没有代码")
+        low, high = 0, latest
+        while low < high:
+            middle = (low + high) // 2
+            if has_code(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _get_logs(self, first_block, last_block):
+        log_filter = {
+            "address": self.factory(),
+            "topics": [PAIR_CREATED_TOPIC],
+            "fromBlock": hex(first_block),
+            "toBlock": hex(last_block),
+        }
+        return self.batch_reader.execute([("eth_getLogs", [log_filter])])[0] or []
+
+    def _scan(self, first_block, last_block):
+        # 并行请求各段日志；某段因范围过大失败时对半拆开重新提交，之后新切的段也使用更小的大小
+        logs = []
+        next_block = first_block
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def submit(start, end):
+                futures[executor.submit(self._get_logs, start, end)] = (start, end)
+
+            while next_block <= last_block or futures:
+                while next_block <= last_block and len(futures) < self.workers:
+                    end = min(next_block + self.chunk_size - 1, last_block)
+                    submit(next_block, end)
+                    next_block = end + 1
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = futures.pop(future)
+                    try:
+                        logs += future.result()
+                    except Exception as e:
+                        size = end - start + 1
+                        if size <= MIN_CHUNK_SIZE or not _is_range_error(e):
+                            raise
+                        self.chunk_size = max(min(self.chunk_size, size // 2), MIN_CHUNK_SIZE)
+                        middle = start + size // 2
+                        submit(start, middle - 1)
+                        submit(middle, end)
+        return logs
+
+    def update(self):
+        # 扫描上次之后的新区块，返回新发现的交易对数量；只有整段扫描成功后才推进游标
+        with self._lock:
+            latest = int(self.batch_reader.execute([("eth_blockNumber", [])])[0], 16)
+            if self.last_block is None:
+                self.last_block = self._deployment_block(latest) - 1
+            first_block = self.last_block + 1
+            if first_block > latest:
+                return 0
+            if latest - first_block + 1 > self.chunk_size * self.workers:
+                print(f"正在索引交易对: 扫描区块 {first_block} - {latest} ...")
+            found = 0
+            for log in self._scan(first_block, latest):
+                pair = to_checksum_address("0x" + log["data"][26:66])
+                if pair not in self.pairs:
+                    self.pairs[pair] = (_topic_address(log["topics"][1]), _topic_address(log["topics"][2]))
+                    found += 1
+            self.last_block = latest
+            self._save_cache()
+            return found
+
+    def pair_for(self, token_a, token_b):
+        # 返回两种代币的交易对地址，索引中没有时返回None
+        tokens = {token_a.lower(), token_b.lower()}
+        for pair, (token0, token1) in self.pairs.items():
+            if {token0.lower(), token1.lower()} == tokens:
+                return pair
+        return None
+
+    def pairs_with(self, token_address):
+        # {另一种代币地址: 交易对地址}
+        token = token_address.lower()
+        result = {}
+        for pair, (token0, token1) in self.pairs.items():
+            if token0.lower() == token:
+                result[token1] = pair
+            elif token1.lower() == token:
+                result[token0] = pair
+        return result
+
+def build_token_registry(pair_index, weth_address, metadata, known_tokens=(), known_lp_tokens=()):
+    # 从索引中与WETH组成的交易对生成{名称: 代币地址}和{名称: LP地址}；已知代币保留原来的名称并排在前面，
+    # 其他代币用symbol命名，重名时加上地址前缀区分
+    pairs_by_token = pair_index.pairs_with(weth_address)
+    # PairCreated日志已经给出token0/token1，直接写入元数据注册表，不再逐个查询交易对合约
+    metadata.register_pairs({pair: pair_index.pairs[pair] for pair in pairs_by_token.values()})
+    metadata.load(pairs_by_token.keys(), pairs_by_token.values())
+
+    tokens = {}
+    lp_tokens = {}
+    known_names = {address.lower(): name for name, address in dict(known_tokens).items()}
+    for name, address in dict(known_tokens).items():
+        pair = pairs_by_token.get(address) or dict(known_lp_tokens).get(name)
+        if pair:
+            tokens[name] = address
+            lp_tokens[name] = pair
+    for address, pair in pairs_by_token.items():
+        if address.lower() in known_names:
+            continue
+        name = metadata.symbol(address) or address[:8]
+        if name in tokens:
+            name = f"{name}-{address[2:6]}"
+        tokens[name] = address
+        lp_tokens[name] = pair
+    return tokens, lp_tokens
+
+def benchmark():
+    # 对比首次并行扫描和之后增量更新的耗时，使用临时缓存文件，不影响正在使用的索引
+    import tempfile
+    from core import CHAIN_ID, UNISWAP_V2_ROUTER_ADDRESS, FACTORY_ADDRESS, PAIR_INDEX_START_BLOCK, batch_reader
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "pairs.json")
+        for label in ("首次扫描", "增量更新"):
+            index = PairIndex(batch_reader._resolve(), UNISWAP_V2_ROUTER_ADDRESS, CHAIN_ID, FACTORY_ADDRESS,
+                              PAIR_INDEX_START_BLOCK, cache_path=cache_path)
+            start = time.perf_counter()
+            found = index.update()
+            elapsed = time.perf_counter() - start
+            print(f"{label}: {elapsed:.2f} 秒, 新发现 {found} 个交易对, 共 {len(index.pairs)} 个, 每段 {index.chunk_size} 个区块")
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        from core import pair_index
+        found = pair_index.update()
+        print(f"工厂合约 {pair_index.factory()}: 共 {len(pair_index.pairs)} 个交易对(新发现 {found} 个)，已扫描到区块 {pair_index.last_block}")
@@ -0,0 +1,70 @@
+import time
+from colorama import Fore, Style
+
+# 交易流水线: 把一个钱包一轮的操作写成一个小的依赖图。步骤按列表顺序发送并分配连续的nonce，
+# 只需要先后顺序的步骤(例如授权和随后的兑换)直接连续发送，可以进入同一个区块；
+# 需要链上结果(储备量、余额、LP数量)的步骤先等待所依赖交易的收据，等待期间通过yield把时间让给其他钱包
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+PENDING = "pending"
+
+class PipelineStep:
+    def __init__(self, name, send, requires=(), wait_for=()):
+        # send(receipts): 发送交易并返回交易哈希，没有需要发送的交易时返回True，失败时返回False或抛出异常；
+        # receipts为已上链步骤的{步骤名: 收据}
+        # requires: 这些步骤已知失败或被跳过时跳过本步骤；wait_for: 发送本步骤之前必须已经上链的步骤
+        self.name = name
+        self.send = send
+        self.requires = tuple(requires)
+        self.wait_for = tuple(wait_for)
+
+def run_pipeline(steps, receipt_tracker, poll_interval=1.0, timeout=300):
+    # 生成器，在StepScheduler的步骤生成器中用yield from调用，返回{步骤名: 状态}
+    status = {}
+    futures = {}
+    receipts = {}
+
+    def settle(name):
+        if status.get(name) != PENDING:
+            return
+        tx_hash, future = futures[name]
+        started = time.monotonic()
+        while not future.done():
+            if time.monotonic() - started > timeout:
+                print(f"  {Fore.RED}❌ 步骤 {name} 的交易在 {timeout} 秒内未上链{Style.RESET_ALL}")
+                receipt_tracker.forget(tx_hash, future)
+                status[name] = FAILED
+                return
+            yield poll_interval
+        receipt = future.result()
+        receipts[name] = receipt
+        if receipt["status"] == 1:
+            status[name] = SUCCEEDED
+        else:
+            print(f"  {Fore.RED}❌ 步骤 {name} 的交易在链上执行失败{Style.RESET_ALL}")
+            status[name] = FAILED
+
+    for step in steps:
+        for name in step.wait_for:
+            yield from settle(name)
+        if any(status.get(name) in (FAILED, SKIPPED) for name in step.requires):
+            status[step.name] = SKIPPED
+            continue
+        try:
+            result = step.send(receipts)
+        except Exception as e:
+            print(f"  {Fore.RED}❌ 步骤 {step.name} 发送失败: {e}{Style.RESET_ALL}")
+            result = False
+        if result is True:
+            status[step.name] = SUCCEEDED
+        elif not result:
+            status[step.name] = FAILED
+        else:
+            futures[step.name] = (result, receipt_tracker.track(result))
+            status[step.name] = PENDING
+
+    for name in list(futures):
+        yield from settle(name)
+    return status
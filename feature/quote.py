@@ -0,0 +1,239 @@
+import math
+import sys
+import threading
+import time
+from eth_utils import to_checksum_address
+from multicall import read_pair_states
+
+# 本地UniswapV2报价: 使用缓存的储备量做精确整数运算，代替路由器的getAmountsOut调用；
+# 有储备量跟踪器时直接读取由Sync事件维护的内存储备量表
+
+MINIMUM_LIQUIDITY = 1000
+
+def get_amount_out(amount_in, reserve_in, reserve_out):
+    if amount_in <= 0:
+        raise ValueError("输入数量必须大于0")
+    if reserve_in <= 0 or reserve_out <= 0:
+        raise ValueError("池中流动性不足")
+    amount_in_with_fee = amount_in * 997
+    numerator = amount_in_with_fee * reserve_out
+    denominator = reserve_in * 1000 + amount_in_with_fee
+    return numerator // denominator
+
+def get_amount_in(amount_out, reserve_in, reserve_out):
+    if amount_out <= 0:
+        raise ValueError("输出数量必须大于0")
+    if reserve_in <= 0 or reserve_out <= amount_out:
+        raise ValueError("池中流动性不足")
+    numerator = reserve_in * amount_out * 1000
+    denominator = (reserve_out - amount_out) * 997
+    return numerator // denominator + 1
+
+def quote(amount_a, reserve_a, reserve_b):
+    if amount_a <= 0:
+        raise ValueError("数量必须大于0")
+    if reserve_a <= 0 or reserve_b <= 0:
+        raise ValueError("池中流动性不足")
+    return amount_a * reserve_b // reserve_a
+
+def liquidity_minted(amount0, amount1, reserve0, reserve1, total_supply):
+    if total_supply == 0:
+        return math.isqrt(amount0 * amount1) - MINIMUM_LIQUIDITY
+    return min(amount0 * total_supply // reserve0, amount1 * total_supply // reserve1)
+
+def liquidity_burned(liquidity, reserve0, reserve1, total_supply):
+    if total_supply <= 0:
+        raise ValueError("LP总供应量为0")
+    return liquidity * reserve0 // total_supply, liquidity * reserve1 // total_supply
+
+class QuoteEngine:
+    def __init__(self, web3, multicall, pair_addresses, block_time=1.0, metadata=None, block_clock=None, reserve_tracker=None,
+                 pair_lookup=None):
+        # pair_lookup(token_a, token_b): 返回不在pair_addresses中的交易对地址，找到后再开始读取该交易对
+        self.web3 = web3
+        self.multicall = multicall
+        self.metadata = metadata
+        self.block_clock = block_clock
+        self.reserve_tracker = reserve_tracker
+        self.pair_lookup = pair_lookup
+        # 在这里导入，quote.py --check只检查公式，不需要.env配置
+        from core import PAIR_ABI
+        self.pair_abi = PAIR_ABI
+        self.pair_contracts = [
+            web3.eth.contract(address=to_checksum_address(pair), abi=self.pair_abi)
+            for pair in pair_addresses
+        ]
+        self.block_time = block_time
+        # (交易对状态, 代币对索引)作为一个整体替换，其他线程读到的两张表总是同一次刷新的结果
+        self._tables = ({}, {})
+        self._state_block = None
+        self._refresh_lock = threading.Lock()
+        self._block_number = None
+        self._block_checked_at = 0
+
+    def current_block(self):
+        # 同一个出块间隔内不重复查询区块高度
+        if self.block_clock is not None:
+            return self.block_clock.block_number()
+        now = time.monotonic()
+        if self._block_number is None or now - self._block_checked_at >= self.block_time:
+            self._block_number = self.web3.eth.block_number
+            self._block_checked_at = now
+        return self._block_number
+
+    def refresh(self, force=False):
+        if self.reserve_tracker is not None:
+            # 跟踪器的储备量表每个区块整体替换，区块变化时才重新建立代币索引
+            tracked_states, block_number = self.reserve_tracker.states()
+            if not force and self._state_block == block_number:
+                return
+            with self._refresh_lock:
+                state_by_pair = {pair_address: {**state, **self.metadata.pair(pair_address)} for pair_address, state in tracked_states.items()}
+                self._store(state_by_pair, block_number)
+            return
+        block_number = self.current_block()
+        if not force and self._state_block == block_number:
+            return
+        # 多个钱包的步骤同时执行时只有一个线程读取，新状态完整构建后才替换旧状态
+        with self._refresh_lock:
+            if not force and self._state_block == block_number:
+                return
+            # 有元数据注册表时token0/token1从缓存读取，只查询储备量和总供应量
+            state_by_pair = read_pair_states(self.multicall, self.pair_contracts, block_number, self.metadata is None)
+            for pair_address, state in state_by_pair.items():
+                if self.metadata is not None:
+                    state.update(self.metadata.pair(pair_address))
+            self._store(state_by_pair, block_number)
+
+    def _store(self, state_by_pair, block_number):
+        pairs_by_tokens = {}
+        for pair_address, state in state_by_pair.items():
+            tokens = (state["token0"].lower(), state["token1"].lower())
+            pairs_by_tokens[tokens] = pair_address
+            pairs_by_tokens[tokens[::-1]] = pair_address
+        self._tables = (state_by_pair, pairs_by_tokens)
+        self._state_block = block_number
+
+    def sync(self, min_block=None):
+        # 自己的交易刚上链时调用，之后的报价至少基于min_block(交易所在区块)的状态
+        if self.reserve_tracker is not None:
+            self.reserve_tracker.sync(min_block)
+        elif self.block_clock is not None:
+            self.block_clock.refresh()
+        self.refresh(force=True)
+
+    def add_pair(self, pair_address):
+        # 开始为新的交易对报价，已读取的交易对不受影响
+        pair_address = to_checksum_address(pair_address)
+        with self._refresh_lock:
+            if any(contract.address == pair_address for contract in self.pair_contracts):
+                return
+            contract = self.web3.eth.contract(address=pair_address, abi=self.pair_abi)
+            self.pair_contracts = self.pair_contracts + [contract]
+        if self.reserve_tracker is not None:
+            self.reserve_tracker.add_pair(contract)
+        self.refresh(force=True)
+
+    def pair_state(self, pair_address):
+        self.refresh()
+        pair_address = to_checksum_address(pair_address)
+        if pair_address not in self._tables[0]:
+            self.add_pair(pair_address)
+        return self._tables[0][pair_address]
+
+    def reserves_for(self, token_a, token_b):
+        self.refresh()
+        state_by_pair, pairs_by_tokens = self._tables
+        pair_address = pairs_by_tokens.get((token_a.lower(), token_b.lower()))
+        if pair_address is None and self.pair_lookup is not None:
+            found = self.pair_lookup(token_a, token_b)
+            if found is not None:
+                self.add_pair(found)
+                state_by_pair, pairs_by_tokens = self._tables
+                pair_address = pairs_by_tokens.get((token_a.lower(), token_b.lower()))
+        if pair_address is None:
+            raise ValueError(f"未找到 {token_a}/{token_b} 的交易对")
+        state = state_by_pair[pair_address]
+        reserve0, reserve1 = state["reserves"][0], state["reserves"][1]
+        if state["token0"].lower() == token_a.lower():
+            return reserve0, reserve1
+        return reserve1, reserve0
+
+    def get_amounts_out(self, amount_in, path):
+        amounts = [amount_in]
+        for token_in, token_out in zip(path, path[1:]):
+            reserve_in, reserve_out = self.reserves_for(token_in, token_out)
+            amounts.append(get_amount_out(amounts[-1], reserve_in, reserve_out))
+        return amounts
+
+    def get_amounts_in(self, amount_out, path):
+        amounts = [amount_out]
+        for token_in, token_out in reversed(list(zip(path, path[1:]))):
+            reserve_in, reserve_out = self.reserves_for(token_in, token_out)
+            amounts.insert(0, get_amount_in(amounts[0], reserve_in, reserve_out))
+        return amounts
+
+    def quote(self, amount_a, token_a, token_b):
+        reserve_a, reserve_b = self.reserves_for(token_a, token_b)
+        return quote(amount_a, reserve_a, reserve_b)
+
+    def remove_liquidity_out(self, pair_address, liquidity, token_a):
+        # 返回(token_a数量, 另一种代币数量)
+        state = self.pair_state(pair_address)
+        amount0, amount1 = liquidity_burned(liquidity, state["reserves"][0], state["reserves"][1], state["total_supply"])
+        if state["token0"].lower() == token_a.lower():
+            return amount0, amount1
+        return amount1, amount0
+
+    def verify_with_router(self, router, amount_in, path):
+        local_amounts = self.get_amounts_out(amount_in, path)
+        router_amounts = router.functions.getAmountsOut(amount_in, path).call(block_identifier=self._state_block)
+        return list(local_amounts) == list(router_amounts)
+
+def _self_check():
+    # 与UniswapV2合约测试中的数值对比(v2-core UniswapV2Pair.spec.ts和v2-periphery UniswapV2Router01.spec.ts)
+    e18 = 10 ** 18
+    swap_cases = [
+        (1, 5, 10, 1662497915624478906),
+        (1, 10, 5, 453305446940074565),
+        (2, 5, 10, 2851015155847869602),
+        (2, 10, 5, 831248957812239453),
+        (1, 10, 10, 906610893880149131),
+        (1, 100, 100, 987158034397061298),
+        (1, 1000, 1000, 996006981039903216),
+    ]
+    for amount_in, reserve_in, reserve_out, expected in swap_cases:
+        assert get_amount_out(amount_in * e18, reserve_in * e18, reserve_out * e18) == expected
+        # 反推的输入量再换出至少要得到期望的输出量，少1 wei则不够
+        amount_needed = get_amount_in(expected, reserve_in * e18, reserve_out * e18)
+        assert get_amount_out(amount_needed, reserve_in * e18, reserve_out * e18) >= expected
+        assert get_amount_out(amount_needed - 1, reserve_in * e18, reserve_out * e18) < expected
+    assert get_amount_out(2, 100, 100) == 1
+    assert get_amount_in(1, 100, 100) == 2
+    assert quote(1, 100, 200) == 2 and quote(2, 200, 100) == 1
+
+    # 首次添加流动性: sqrt(x*y)减去永久锁定的MINIMUM_LIQUIDITY；不超过MINIMUM_LIQUIDITY时合约会拒绝
+    assert liquidity_minted(e18, 4 * e18, 0, 0, 0) == 2 * e18 - MINIMUM_LIQUIDITY
+    assert liquidity_minted(MINIMUM_LIQUIDITY, MINIMUM_LIQUIDITY, 0, 0, 0) <= 0
+    assert liquidity_minted(e18, 2 * e18, e18, 4 * e18, 2 * e18) == e18
+    assert liquidity_burned(3 * e18 - MINIMUM_LIQUIDITY, 3 * e18, 3 * e18, 3 * e18) == (3 * e18 - MINIMUM_LIQUIDITY,) * 2
+
+    # 边界: 输出量等于储备量、数量或储备量为0时与合约一样拒绝
+    for check, args in [
+        (get_amount_in, (100, 1000, 100)),
+        (get_amount_out, (0, 100, 100)),
+        (get_amount_out, (1, 0, 100)),
+        (get_amount_in, (0, 100, 100)),
+        (quote, (1, 0, 100)),
+        (liquidity_burned, (1, 100, 100, 0)),
+    ]:
+        try:
+            check(*args)
+        except ValueError:
+            continue
+        raise AssertionError(f"{check.__name__}{args} 应该失败")
+    print(f"自检通过: {len(swap_cases)} 组UniswapV2兑换数值、流动性计算和边界情况与合约一致")
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        _self_check()
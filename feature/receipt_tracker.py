@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from batch_reader import is_method_not_supported
+
+# 交易收据跟踪: 所有待确认的交易哈希由一个后台线程统一轮询，
+# 每个新区块一次eth_getBlockReceipts(或批量eth_getTransactionReceipt)，
+# 交易上链后通过Future通知等待方
+
+RECEIPT_QUANTITY_FIELDS = ("blockNumber", "cumulativeGasUsed", "effectiveGasPrice", "gasUsed", "status", "transactionIndex", "type")
+
+def _timeout_error(tx_hash, timeout):
+    # 与web3.eth.wait_for_transaction_receipt保持相同的超时异常类型
+    from web3.exceptions import TimeExhausted
+    return TimeExhausted(f"交易 {_hash_key(tx_hash)} 在 {timeout} 秒内未上链")
+
+def _hash_key(tx_hash):
+    if isinstance(tx_hash, (bytes, bytearray)):
+        return "0x" + bytes(tx_hash).hex()
+    return tx_hash.lower()
+
+def _format_receipt(raw):
+    from web3.datastructures import AttributeDict
+    receipt = dict(raw)
+    for field in RECEIPT_QUANTITY_FIELDS:
+        if isinstance(receipt.get(field), str):
+            receipt[field] = int(receipt[field], 16)
+    return AttributeDict(receipt)
+
+class ReceiptTracker:
+    def __init__(self, batch_reader, poll_interval=1.0, block_clock=None, on_timeout=None):
+        # on_timeout(tx_hash): 等待方超时放弃一笔交易后调用，例如检查交易是否被丢弃并回收nonce
+        self.batch_reader = batch_reader
+        self.on_timeout = on_timeout
+        self.poll_interval = poll_interval
+        self.block_clock = block_clock
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._unchecked = set()
+        self._last_block = None
+        self._block_receipts_supported = True
+        self._thread = None
+
+    def track(self, tx_hash, callback=None):
+        # 返回Future，交易上链后结果为收据；callback在收据返回后以Future为参数调用
+        key = _hash_key(tx_hash)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None or future.done():
+                future = Future()
+                self._pending[key] = future
+                self._unchecked.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def wait(self, tx_hash, timeout=300):
+        future = self.track(tx_hash)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.forget(tx_hash, future)
+            raise _timeout_error(tx_hash, timeout)
+
+    async def wait_async(self, tx_hash, timeout=300):
+        future = self.track(tx_hash)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.forget(tx_hash, future)
+            raise _timeout_error(tx_hash, timeout)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def forget(self, tx_hash, future):
+        # 等待方超时放弃时调用: 不再轮询该交易并取消Future
+        key = _hash_key(tx_hash)
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+                self._unchecked.discard(key)
+        if future.cancel() and self.on_timeout is not None:
+            try:
+                self.on_timeout(tx_hash)
+            except Exception:
+                # 只是尽量回收nonce，节点错误时忽略，之后发送失败时仍会重新同步
+                pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                for key in [key for key, future in self._pending.items() if future.done()]:
+                    del self._pending[key]
+                    self._unchecked.discard(key)
+                if not self._pending:
+                    self._thread = None
+                    return
+            try:
+                self._poll()
+            except Exception:
+                # 节点临时错误时下一轮继续轮询，由等待方的超时兜底
+                pass
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        if self.block_clock is not None:
+            block_number = self.block_clock.block_number()
+        else:
+            block_number = int(self.batch_reader.execute([("eth_blockNumber", [])])[0], 16)
+        with self._lock:
+            unchecked = list(self._unchecked)
+            self._unchecked.clear()
+            pending_count = len(self._pending)
+
+        # 新加入的哈希可能已经在扫描过的区块中上链，先单独查询一次
+        if unchecked:
+            try:
+                self._check_hashes(unchecked)
+            except Exception:
+                with self._lock:
+                    self._unchecked.update(key for key in unchecked if key in self._pending)
+                raise
+
+        if self._last_block is None or block_number <= self._last_block:
+            self._last_block = max(block_number, self._last_block or 0)
+            return
+
+        first_block = self._last_block + 1
+        block_count = block_number - self._last_block
+        scanned_block = block_number
+        # 区块数比待确认交易还多时，直接按哈希查询更省请求
+        if self._block_receipts_supported and block_count <= pending_count:
+            try:
+                scanned_block = self._check_blocks(first_block, block_number)
+            except ValueError as e:
+                # 其他错误按本轮轮询失败处理，游标不前进，下一轮重试同一段区块
+                if not is_method_not_supported(e):
+                    raise
+                self._block_receipts_supported = False
+                self._check_hashes(self._pending_keys())
+        else:
+            self._check_hashes(self._pending_keys())
+        self._last_block = scanned_block
+
+    def _pending_keys(self):
+        with self._lock:
+            return list(self._pending)
+
+    def _check_blocks(self, first_block, last_block):
+        # 返回已经读到收据的最后一个区块；落后的节点对还没有导入的区块返回null，从该区块起下一轮重试
+        calls = [("eth_getBlockReceipts", [hex(block)]) for block in range(first_block, last_block + 1)]
+        scanned_block = first_block - 1
+        for receipts in self.batch_reader.execute(calls):
+            if receipts is None:
+                break
+            for raw in receipts:
+                self._resolve(raw)
+            scanned_block += 1
+        return scanned_block
+
+    def _check_hashes(self, keys):
+        if not keys:
+            return
+        calls = [("eth_getTransactionReceipt", [key]) for key in keys]
+        for raw in self.batch_reader.execute(calls):
+            if raw is not None:
+                self._resolve(raw)
+
+    def _resolve(self, raw):
+        key = raw["transactionHash"].lower()
+        with self._lock:
+            future = self._pending.pop(key, None)
+            self._unchecked.discard(key)
+        if future is not None and future.set_running_or_notify_cancel():
+            future.set_result(_format_receipt(raw))
@@ -0,0 +1,218 @@
+import sys
+import threading
+import time
+from multicall import read_pair_states
+
+# 储备量跟踪: 启动时用multicall读取一次所有交易对的储备量和LP总供应量，之后每个新区块用eth_getLogs
+# 从上次的游标增量读取Sync事件更新内存中的储备量表，报价和滑点计算直接读内存，不再请求节点；
+# Mint/Burn事件改变LP总供应量，出现时只重新读取对应交易对的totalSupply
+
+SYNC_TOPIC = "0x1c411e9a96e071241c2f21f7726b17ae89e3cab4c78be50e062b03a9fffbbad1"
+MINT_TOPIC = "0x4c209b5fc8ad50758f13e2e1088ba56a560dff690a1c6fef26394f4c03821c4f"
+BURN_TOPIC = "0xdccd412f0b1252819cb1fd330b93224ca42612892bb3f4f789976e6d81936496"
+MAX_LOG_RANGE = 2000  # 落后超过这么多区块时(例如长时间空闲后)直接重新读取快照
+IDLE_TIMEOUT = 30  # 超过这段时间没有读取时停止后台轮询，下次读取时自动补齐
+SYNC_ATTEMPTS = 5
+
+class ReserveTracker:
+    def __init__(self, batch_reader, multicall, pair_contracts, block_clock, poll_interval=1.0, max_log_range=MAX_LOG_RANGE):
+        self.batch_reader = batch_reader
+        self.multicall = multicall
+        self.block_clock = block_clock
+        self.poll_interval = poll_interval
+        self.max_log_range = max_log_range
+        self.pair_contracts = {contract.address: contract for contract in pair_contracts}
+        self._addresses = {address.lower(): address for address in self.pair_contracts}
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._state = {}
+        self.block = None
+        self._last_read = 0
+        self._thread = None
+
+    def _snapshot(self, block_number, pair_contracts=None):
+        if pair_contracts is None:
+            pair_contracts = list(self.pair_contracts.values())
+        states = read_pair_states(self.multicall, pair_contracts, block_number, include_tokens=False)
+        return {
+            address: {"reserves": (state["reserves"][0], state["reserves"][1]), "total_supply": state["total_supply"]}
+            for address, state in states.items()
+        }
+
+    def _apply_logs(self, state, logs, block_number):
+        # 在状态副本上按区块和日志顺序应用事件，Sync事件给出的是完整的储备量，直接覆盖
+        supply_changed = set()
+        for log in sorted(logs, key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16))):
+            address = self._addresses.get(log["address"].lower())
+            if address is None or log.get("removed"):
+                continue
+            if log["topics"][0] == SYNC_TOPIC:
+                data = log["data"][2:]
+                state[address] = {**state[address], "reserves": (int(data[:64], 16), int(data[64:128], 16))}
+            else:
+                supply_changed.add(address)
+        if supply_changed:
+            addresses = sorted(supply_changed)
+            calls = [(self.pair_contracts[address], "totalSupply", []) for address in addresses]
+            for address, total_supply in zip(addresses, self.multicall.call(calls, block_number)):
+                state[address] = {**state[address], "total_supply": total_supply}
+        return state
+
+    def _update(self, target_block):
+        # 把储备量表推进到target_block，节点还没有同步到该区块时返回False，下次再试
+        with self._update_lock:
+            if self.block is not None and target_block <= self.block:
+                return True
+            if self.block is None or target_block - self.block > self.max_log_range:
+                state = self._snapshot(target_block)
+            else:
+                log_filter = {
+                    "address": list(self.pair_contracts),
+                    "topics": [[SYNC_TOPIC, MINT_TOPIC, BURN_TOPIC]],
+                    "fromBlock": hex(self.block + 1),
+                    "toBlock": hex(target_block),
+                }
+                # 同一个批量请求发往同一个节点，用它返回的区块高度确认日志是完整的
+                node_block, logs = self.batch_reader.execute([("eth_blockNumber", []), ("eth_getLogs", [log_filter])])
+                if int(node_block, 16) < target_block:
+                    return False
+                state = self._apply_logs(dict(self._state), logs or [], target_block)
+            # 新表完整构建后才替换，读取方不会看到一半更新的状态
+            with self._lock:
+                self._state = state
+                self.block = target_block
+            return True
+
+    def add_pair(self, pair_contract):
+        # 开始跟踪新的交易对: 在当前游标的区块读取一次它的状态并合并到储备量表，之后和其他交易对一起用事件更新
+        with self._update_lock:
+            if pair_contract.address in self.pair_contracts:
+                return
+            self.pair_contracts[pair_contract.address] = pair_contract
+            self._addresses[pair_contract.address.lower()] = pair_contract.address
+            if self.block is None:
+                return
+            state = {**self._state, **self._snapshot(self.block, [pair_contract])}
+            with self._lock:
+                self._state = state
+
+    def _touch(self):
+        with self._lock:
+            self._last_read = time.monotonic()
+            restarted = self._thread is None
+            if restarted:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if restarted:
+            # 第一次读取或空闲停止后重新启动时先同步补齐到最新区块，报价和滑点下限不会基于过时的储备量
+            self._update(self.block_clock.refresh())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if time.monotonic() - self._last_read > IDLE_TIMEOUT:
+                    self._thread = None
+                    return
+            try:
+                self._update(self.block_clock.block_number())
+            except Exception:
+                # 节点临时错误时继续使用当前的储备量表，下一个区块再补齐
+                pass
+            time.sleep(self.poll_interval)
+
+    def states(self):
+        # 返回({交易对地址: {"reserves", "total_supply"}}, 区块高度)，返回的表之后不会再被修改
+        self._touch()
+        with self._lock:
+            return self._state, self.block
+
+    def state(self, pair_address):
+        states, _ = self.states()
+        return states[self._addresses[pair_address.lower()]]
+
+    def sync(self, min_block=None):
+        # 交易刚上链时调用: 立即补齐到最新区块，且至少到min_block(交易所在区块)
+        self._touch()
+        for _ in range(SYNC_ATTEMPTS):
+            target_block = max(self.block_clock.refresh(), min_block or 0)
+            if self._update(target_block):
+                break
+            time.sleep(self.poll_interval)
+        return self.block
+
+def _self_check():
+    # 用模拟的节点检查: 增量应用Sync/Mint事件后的储备量表与直接读取的快照一致，节点落后时不推进游标
+    import random
+
+    class Contract:
+        def __init__(self, address):
+            self.address = address
+
+    chain = {}
+
+    def encode(value):
+        return hex(value)[2:].rjust(64, "0")
+
+    class FakeMulticall:
+        def call(self, calls, block_identifier=None):
+            results = []
+            for contract, name, _ in calls:
+                reserves, total_supply = chain[(contract.address, block_identifier)]
+                results.append((*reserves, 0) if name == "getReserves" else total_supply)
+            return results
+
+    pairs = [f"0x{index:040x}" for index in range(1, 4)]
+    logs = []
+    state = {pair: ((10 ** 18, 5 * 10 ** 18), 10 ** 18) for pair in pairs}
+    for block in range(1, 201):
+        for pair in pairs:
+            if random.random() < 0.3:
+                reserves, total_supply = state[pair]
+                reserves = (reserves[0] + random.randint(-10 ** 15, 10 ** 15), reserves[1] + random.randint(-10 ** 15, 10 ** 15))
+                if random.random() < 0.2:
+                    total_supply += random.randint(1, 10 ** 15)
+                    logs.append({"address": pair, "topics": [MINT_TOPIC], "data": "0x", "blockNumber": hex(block), "logIndex": hex(len(logs))})
+                logs.append({"address": pair, "topics": [SYNC_TOPIC], "data": "0x" + encode(reserves[0]) + encode(reserves[1]),
+                             "blockNumber": hex(block), "logIndex": hex(len(logs))})
+                state[pair] = (reserves, total_supply)
+            chain[(pair, block)] = state[pair]
+
+    node = {"block": 1}
+
+    class FakeReader:
+        def execute(self, calls):
+            log_filter = calls[1][1][0]
+            first, last = int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16)
+            return [hex(node["block"]), [log for log in logs if first <= int(log["blockNumber"], 16) <= last]]
+
+    class FakeClock:
+        def block_number(self):
+            return node["block"]
+
+        refresh = block_number
+
+    # 最后一个交易对在中途才开始跟踪
+    tracker = ReserveTracker(FakeReader(), FakeMulticall(), [Contract(pair) for pair in pairs[:-1]], FakeClock())
+    tracker._update(1)
+    for block in range(2, 201, 7):
+        node["block"] = block
+        assert tracker._update(block)
+        if block == 100:
+            tracker.add_pair(Contract(pairs[-1]))
+    assert not tracker._update(205) and tracker.block == 198
+    node["block"] = 200
+    assert tracker._update(200)
+    for pair in pairs:
+        reserves, total_supply = chain[(pair, 200)]
+        assert tracker._state[pair] == {"reserves": reserves, "total_supply": total_supply}
+    print(f"自检通过: {len(logs)} 个事件增量应用后与第200个区块的快照一致")
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        _self_check()
+    else:
+        from core import reserve_tracker
+        states, block = reserve_tracker.states()
+        for address, state in states.items():
+            print(f"{address}: 储备量 {state['reserves'][0]} / {state['reserves'][1]}, LP总供应量 {state['total_supply']}")
+        print(f"区块 {block}")
@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import sys
+import threading
+import time
+from colorama import Fore, Style
+from wallet_executor import MAX_SCHEDULED_WALLETS, report_round_time
+
+# 步骤调度器: 每个钱包的一轮操作写成生成器，每完成一步就yield下一步之前要等待的秒数。
+# 所有钱包按下一步的就绪时间放在一个堆中，某个钱包等待期间由其他已就绪钱包的步骤填满，
+# 每个钱包仍保留自己的随机间隔，一轮的耗时不再是所有等待时间之和；同时执行的步骤数不超过max_inflight
+
+class StepScheduler:
+    def __init__(self, max_inflight=1, max_active=MAX_SCHEDULED_WALLETS):
+        if max_inflight < 1:
+            raise ValueError("同时执行的步骤数必须至少为1")
+        self.max_inflight = int(max_inflight)
+        self.max_active = int(max_active)
+
+    def run_round(self, wallet_count, make_steps):
+        # make_steps(position)返回该钱包的步骤生成器，生成器的返回值作为该钱包的结果
+        condition = threading.Condition()
+        heap = []
+        sequence = itertools.count()
+        positions = iter(range(wallet_count))
+        state = {"active": 0, "exhausted": wallet_count == 0, "stopped": False}
+        results = []
+
+        def next_step():
+            # 优先继续已开始且到时间的钱包，没有时再开始新的钱包，都没有时等到最早的就绪时间
+            with condition:
+                while not state["stopped"]:
+                    now = time.monotonic()
+                    if heap and heap[0][0] <= now:
+                        _, _, position, steps = heapq.heappop(heap)
+                        return position, steps
+                    if not state["exhausted"] and state["active"] < self.max_active:
+                        position = next(positions, None)
+                        if position is None:
+                            state["exhausted"] = True
+                        else:
+                            state["active"] += 1
+                            return position, None
+                    if state["exhausted"] and state["active"] == 0:
+                        return None
+                    condition.wait(heap[0][0] - now if heap else None)
+            return None
+
+        def finish(result):
+            with condition:
+                results.append(result)
+                state["active"] -= 1
+                condition.notify_all()
+
+        def worker():
+            while True:
+                item = next_step()
+                if item is None:
+                    return
+                position, steps = item
+                try:
+                    if steps is None:
+                        steps = make_steps(position)
+                    delay = next(steps)
+                except StopIteration as stop:
+                    finish(stop.value)
+                except Exception as e:
+                    print(f"  {Fore.RED}❌ 钱包 #{position + 1} 执行过程中发生意外错误: {e}{Style.RESET_ALL}")
+                    finish(None)
+                else:
+                    with condition:
+                        heapq.heappush(heap, (time.monotonic() + max(delay, 0), next(sequence), position, steps))
+                        condition.notify()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(self.max_inflight, max(wallet_count, 1)))]
+        for thread in threads:
+            thread.start()
+        try:
+            # 带超时的join，主线程可以及时响应Ctrl+C
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            with condition:
+                state["stopped"] = True
+                condition.notify_all()
+            raise
+        return results, time.perf_counter() - start
+
+    def run(self, wallet_count, make_steps, run_in_loop=False, before_round=None):
+        round_number = 0
+        while True:
+            round_number += 1
+            if before_round is not None:
+                before_round()
+            results, elapsed = self.run_round(wallet_count, make_steps)
+            succeeded = sum(1 for result in results if result)
+            print(f"{Fore.GREEN}✅ 本轮成功 {succeeded}/{wallet_count} 个钱包{Style.RESET_ALL}")
+            report_round_time(f"交错x{self.max_inflight}", round_number, elapsed, wallet_count)
+            if not run_in_loop:
+                break
+
+def benchmark(wallet_count=20, steps=4, step_time=0.2, min_delay=1.0, max_delay=2.0, max_inflight=4):
+    # 模拟每步耗时step_time秒、步骤之间随机等待的钱包，比较逐个等待和交错调度的总耗时
+    import random
+    delays = [[random.uniform(min_delay, max_delay) for _ in range(steps)] for _ in range(wallet_count)]
+    serial = wallet_count * steps * step_time + sum(map(sum, delays))
+
+    def make_steps(position):
+        for delay in delays[position]:
+            time.sleep(step_time)
+            yield delay
+        return True
+
+    results, elapsed = StepScheduler(max_inflight).run_round(wallet_count, make_steps)
+    assert len(results) == wallet_count and all(results)
+    print(f"{wallet_count} 个钱包 x {steps} 步: 逐个等待 {serial:.1f} 秒, 交错调度(x{max_inflight}) {elapsed:.1f} 秒")
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,310 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from wallet_index import fingerprint, key_bytes
+
+# 交易签名服务: 批量签名时把未签名的交易字典分块交给多个工作进程并行签名。
+# 私钥在钱包第一次签名前才从来源读取(keystore在这时才解密)；工作进程按指纹保存收到过的私钥，
+# 签名请求平时只携带指纹，工作进程还没有该私钥时才随重发的请求传一次，不会把整个钱包列表发给每个进程。
+# 安装了coincurve(libsecp256k1)时直接编码RLP并用coincurve签名，否则使用eth_account
+
+FIELD_CACHE_SIZE = 1024
+KEY_CACHE_SIZE = 4096
+POOL_MIN_BATCH = 8  # 并发模式下同时等待签名的交易少于这个数时在当前进程中签名
+
+def _rlp_length(length, offset):
+    if length < 56:
+        return bytes([offset + length])
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([offset + 55 + len(length_bytes)]) + length_bytes
+
+def _rlp_bytes(value):
+    if len(value) == 1 and value[0] < 0x80:
+        return value
+    return _rlp_length(len(value), 0x80) + value
+
+def _rlp_int(value):
+    return _rlp_bytes(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+def _rlp_list(encoded_items):
+    payload = b"".join(encoded_items)
+    return _rlp_length(len(payload), 0xc0) + payload
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
+
+def _to_int(value):
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+class KeyHandle:
+    # id是私钥指纹，用来缓存每个钱包解析好的签名对象
+    __slots__ = ("id", "key")
+
+    def __init__(self, id, key):
+        self.id = id
+        self.key = key
+
+    @classmethod
+    def from_private_key(cls, private_key):
+        return cls(fingerprint(private_key), key_bytes(private_key))
+
+def _cache_put(cache, key, value):
+    if len(cache) >= KEY_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+class EthAccountBackend:
+    name = "eth_account"
+
+    def __init__(self):
+        self._accounts = {}
+
+    def sign(self, account, transaction):
+        local_account = self._accounts.get(account.id)
+        if local_account is None:
+            from eth_account import Account
+            local_account = Account.from_key(account.key)
+            _cache_put(self._accounts, account.id, local_account)
+        return bytes(local_account.sign_transaction(transaction).raw_transaction)
+
+class CoincurveBackend:
+    # 支持legacy(EIP-155)和不带accessList的EIP-1559交易，其他交易交给eth_account签名。
+    # 同一批交易的chainId、to和data经常相同，这些字段的RLP编码会被缓存，只重新编码nonce、gas等变化的字段
+    name = "coincurve"
+
+    def __init__(self):
+        from coincurve import PrivateKey
+        from eth_utils import keccak
+        self._private_key_class = PrivateKey
+        self._keccak = keccak
+        self._fallback = EthAccountBackend()
+        self._keys = {}
+        self._fields = {}
+
+    def _field(self, kind, value):
+        key = (kind, value if isinstance(value, (str, int)) else bytes(value))
+        encoded = self._fields.get(key)
+        if encoded is None:
+            if len(self._fields) >= FIELD_CACHE_SIZE:
+                self._fields.clear()
+            encoded = _rlp_int(_to_int(value)) if kind == "int" else _rlp_bytes(_to_bytes(value) if value else b"")
+            self._fields[key] = encoded
+        return encoded
+
+    def _key(self, account):
+        key = self._keys.get(account.id)
+        if key is None:
+            key = self._private_key_class(account.key)
+            _cache_put(self._keys, account.id, key)
+        return key
+
+    def sign(self, account, transaction):
+        transaction_type = transaction.get("type")
+        typed = "maxFeePerGas" in transaction
+        if transaction.get("accessList") or transaction_type not in (None, 0, 2, "0x0", "0x2") or ("gasPrice" not in transaction and not typed):
+            return self._fallback.sign(account, transaction)
+
+        common = [
+            _rlp_int(_to_int(transaction["nonce"])),
+            *([] if not typed else [_rlp_int(_to_int(transaction["maxPriorityFeePerGas"])), _rlp_int(_to_int(transaction["maxFeePerGas"]))]),
+            *([] if typed else [_rlp_int(_to_int(transaction["gasPrice"]))]),
+            _rlp_int(_to_int(transaction["gas"])),
+            self._field("bytes", transaction.get("to") or b""),
+            _rlp_int(_to_int(transaction.get("value", 0))),
+            self._field("bytes", transaction.get("data") or b""),
+        ]
+        chain_id = transaction.get("chainId")
+        if typed:
+            prefix = b"\x02"
+            fields = [self._field("int", chain_id)] + common + [b"\xc0"]
+            unsigned = fields
+        else:
+            prefix = b""
+            fields = common
+            unsigned = common + ([self._field("int", chain_id), b"\x80", b"\x80"] if chain_id is not None else [])
+
+        signature = self._key(account).sign_recoverable(self._keccak(prefix + _rlp_list(unsigned)), hasher=None)
+        r = int.from_bytes(signature[:32], "big")
+        s = int.from_bytes(signature[32:64], "big")
+        recovery_id = signature[64]
+        if typed:
+            v = recovery_id
+        elif chain_id is not None:
+            v = recovery_id + 35 + 2 * _to_int(chain_id)
+        else:
+            v = recovery_id + 27
+        return prefix + _rlp_list(fields + [_rlp_int(v), _rlp_int(r), _rlp_int(s)])
+
+def create_backend(name="auto"):
+    # name: "auto"有coincurve时使用coincurve, "coincurve"或"eth_account"
+    if name not in ("auto", "coincurve", "eth_account"):
+        raise ValueError(f"未知的签名后端: {name}")
+    if name != "eth_account":
+        try:
+            return CoincurveBackend()
+        except ImportError:
+            if name == "coincurve":
+                raise
+    return EthAccountBackend()
+
+_worker_backend = None
+_worker_keys = {}
+
+def _init_worker(backend_name):
+    global _worker_backend
+    _worker_backend = create_backend(backend_name)
+
+def _sign_batch(items):
+    # items: [(私钥指纹, 私钥字节或None, 交易字典), ...]，返回签名后的原始交易字节；
+    # 本进程还没有收到过的私钥返回None，由调用方带上私钥重发
+    results = []
+    for key_id, key, transaction in items:
+        handle = _worker_keys.get(key_id)
+        if handle is None and key is not None:
+            handle = KeyHandle(key_id, key)
+            _cache_put(_worker_keys, key_id, handle)
+        results.append(None if handle is None else _worker_backend.sign(handle, transaction))
+    return results
+
+class SigningService:
+    def __init__(self, workers=0, chunk_size=64, backend="auto"):
+        # workers为0时在当前进程中签名；进程间通信的开销比单笔签名还大，所以单笔签名和小批量签名
+        # 在当前进程中完成，只有sign_many的大批量和并发模式下攒够POOL_MIN_BATCH笔的签名才交给工作进程
+        if workers < 0:
+            raise ValueError("签名进程数不能为负数")
+        self.workers = int(workers)
+        self.backend = create_backend(backend)
+        self.chunk_size = int(chunk_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = []
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.backend.name,))
+            return self._executor
+
+    def sign(self, transaction, private_key):
+        return self.backend.sign(KeyHandle.from_private_key(private_key), transaction)
+
+    async def sign_async(self, transaction, private_key):
+        # 并发模式下事件循环同一轮中提交的签名先攒成一批，下一轮一起签名
+        if not self.workers:
+            return self.sign(transaction, private_key)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((transaction, private_key, future))
+        if len(self._pending) == 1:
+            loop.call_soon(lambda: loop.create_task(self._flush()))
+        return await future
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        items = [(transaction, private_key) for transaction, private_key, _ in batch]
+        try:
+            if len(items) < POOL_MIN_BATCH:
+                results = [self.sign(transaction, private_key) for transaction, private_key in items]
+            else:
+                # 平均分给所有工作进程，在线程中等待结果，不阻塞事件循环
+                chunk_size = min(self.chunk_size, -(-len(items) // self.workers))
+                results = await asyncio.to_thread(self._sign_in_pool, items, chunk_size)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), raw in zip(batch, results):
+            if not future.done():
+                future.set_result(raw)
+
+    def _sign_in_pool(self, items, chunk_size):
+        # 第一次只发指纹；工作进程没有该私钥时返回None，这些交易带上私钥再发一次，之后该进程就不再需要
+        key_ids = [fingerprint(private_key) for _, private_key in items]
+        results = [None] * len(items)
+        pending = list(range(len(items)))
+        with_keys = False
+        while pending:
+            chunks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+            payloads = [
+                [(key_ids[index], key_bytes(items[index][1]) if with_keys else None, items[index][0]) for index in chunk]
+                for chunk in chunks
+            ]
+            missing = []
+            for chunk, signed in zip(chunks, self._pool().map(_sign_batch, payloads)):
+                for index, raw in zip(chunk, signed):
+                    if raw is None:
+                        missing.append(index)
+                    else:
+                        results[index] = raw
+            pending = missing
+            with_keys = True
+        return results
+
+    def sign_many(self, items):
+        # items: [(交易字典, 私钥), ...]，按原顺序返回签名后的原始交易
+        if not self.workers or len(items) <= self.chunk_size:
+            return [self.sign(transaction, private_key) for transaction, private_key in items]
+        return self._sign_in_pool(items, self.chunk_size)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+def _sample_transactions(count, wallet_count):
+    private_keys = ["0x" + os.urandom(32).hex() for _ in range(wallet_count)]
+    items = []
+    for index in range(count):
+        transaction = {
+            "to": "0x32aA9448586b06d2d42Fe4CFabF1c7AcD03bAE31",
+            "value": index * 10 ** 12,
+            "data": "0x7ff36ab5" + os.urandom(32).hex() + "00" * 128,
+            "gas": 200000 + index,
+            "nonce": index,
+            "chainId": 3940,
+        }
+        if index % 2:
+            transaction.update({"maxFeePerGas": 2 * 10 ** 9 + index, "maxPriorityFeePerGas": index, "type": 2})
+        else:
+            transaction["gasPrice"] = 10 ** 9 + index
+        items.append((transaction, private_keys[index % wallet_count]))
+    return private_keys, items
+
+def check_backends(count=200):
+    # 两个后端对同一批legacy和EIP-1559交易的签名结果必须逐字节相同
+    _, items = _sample_transactions(count, 10)
+    expected = SigningService(backend="eth_account").sign_many(items)
+    actual = SigningService(backend="coincurve").sign_many(items)
+    mismatches = [index for index, (a, b) in enumerate(zip(expected, actual)) if a != b]
+    if mismatches:
+        raise AssertionError(f"coincurve签名与eth_account不一致: 第 {mismatches[:5]} 笔交易")
+    print(f"✅ coincurve与eth_account对 {count} 笔交易的签名完全一致")
+
+def benchmark(count=4000, wallet_count=100):
+    # 随机生成钱包和交易，比较两个签名后端，以及1/2/4/8个工作进程的签名速度
+    _, items = _sample_transactions(count, wallet_count)
+    print(f"{'签名后端':<14}{'签名进程数':<10}{'耗时':>10}{'签名/秒':>12}")
+    runs = [("eth_account", 0)] + [("auto", workers) for workers in (0, 1, 2, 4, 8)]
+    for backend, workers in runs:
+        service = SigningService(workers, backend=backend)
+        # 先签一小批，让工作进程完成启动并缓存各钱包的签名对象，只统计稳定后的速度
+        service.sign_many(items[:service.chunk_size * max(workers, 1) + 1])
+        start = time.perf_counter()
+        service.sign_many(items)
+        elapsed = time.perf_counter() - start
+        service.shutdown()
+        label = "当前进程" if workers == 0 else str(workers)
+        print(f"{service.backend.name:<14}{label:<10}{elapsed:>9.2f}s{count / elapsed:>12.0f}")
+
+if __name__ == "__main__":
+    if "--check" in sys.argv[1:]:
+        check_backends()
+    else:
+        benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 4000)
@@ -1,9 +1,11 @@
-import os
 import random
-import time
-from web3 import Web3
-from dotenv import load_dotenv
-from colorama import Fore
+from core import (
+    PRIVATE_KEYS, CHAIN_ID, MAX_INFLIGHT, UNISWAP_V2_ROUTER_ADDRESS, WETH_ADDRESS,
+    AVAILABLE_TOKENS, transport, web3, nonce_manager, wallet_index, signer, calldata,
+    batch_reader, block_clock, receipt_tracker, gas_estimator, fee_oracle, warm_up,
+)
+from wallet_executor import AsyncWalletExecutor, create_async_web3
+from scheduler import StepScheduler
 
 class Colors:
     RESET = "\033[0m"
@@ -17,75 +19,120 @@ class Colors:
     BOLD = "\033[1m"
     UNDERLINE = "\033[4m"
 
-load_dotenv()
-
-PRIVATE_KEYS = os.getenv("PRIVATE_KEYS").split(",")
-if not PRIVATE_KEYS:
-    raise ValueError(f"{Colors.RED}.env文件中未找到私钥{Colors.RESET}")
-
-RPC_URL = "https://testnet3.rpc.nexus.xyz"
-CHAIN_ID = 3940
+TOKEN_ADDRESS = ""
+SELECTED_TOKEN_NAME = ""
 
-UNISWAP_V2_ROUTER_ADDRESS = "0x32aA9448586b06d2d42Fe4CFabF1c7AcD03bAE31"
+def swap_eth_for_tokens(account, private_key, amount_in_wei, amount_out_min, token_address_to_swap):
+    path = [WETH_ADDRESS, token_address_to_swap]
 
-AVAILABLE_TOKENS = {
-    "NXS": "0x3eC55271351865ab99a9Ce92272C3E908f2E627b",
-    "NEXI": "0x184eE44cF8B7Fec2371dc46D9076fFB2c1E0Ce65",
-    "AIE": "0xF6f61565947621387ADF3BeD7ba02533aB013CCd"
-}
+    fees = fee_oracle.fees()
 
-TOKEN_ADDRESS = ""
-SELECTED_TOKEN_NAME = ""
+    expired = False
+    while True:
+        nonce = None
+        tx_hash = None
+        gas_limit = None
+        try:
+            nonce = nonce_manager.allocate(account.address)
 
-web3 = Web3(Web3.HTTPProvider(RPC_URL))
-if not web3.is_connected():
-    raise ConnectionError(f"{Colors.RED}连接RPC URL失败{Colors.RESET}")
+            call = {
+                'from': account.address,
+                'to': UNISWAP_V2_ROUTER_ADDRESS,
+                'value': amount_in_wei,
+                'data': calldata.encode("swapExactETHForTokens", amount_out_min, path, account.address, block_clock.deadline())
+            }
+            gas_limit = gas_estimator.limit("swap_eth_for_tokens", token_address_to_swap, lambda: web3.eth.estimate_gas(call), 200000)
+            transaction = {
+                **call,
+                'gas': gas_limit,
+                **fees,
+                'nonce': nonce,
+                'chainId': CHAIN_ID
+            }
 
-uniswap_v2_router_abi = '[{"inputs":[{"internalType":"uint256","name":"amountOutMin","type":"uint256"},{"internalType":"address[]","name":"path","type":"address[]"},{"internalType":"address","name":"to","type":"address"},{"internalType":"uint256","name":"deadline","type":"uint256"}],"name":"swapExactETHForTokens","outputs":[{"internalType":"uint256[]","name":"amounts","type":"uint256[]"}],"stateMutability":"payable","type":"function"}]'
+            raw_transaction = signer.sign(transaction, private_key)
+            tx_hash = web3.eth.send_raw_transaction(raw_transaction)
+            nonce_manager.sent(account.address, nonce, tx_hash)
+            receipt_tracker.track(tx_hash, gas_estimator.receipt_callback("swap_eth_for_tokens", token_address_to_swap, gas_limit))
+            print(f"  {Colors.GREEN}✅ {Colors.BOLD}交易已发送{Colors.RESET}")
+            return web3.to_hex(tx_hash)
 
-uniswap_router = web3.eth.contract(address=Web3.to_checksum_address(UNISWAP_V2_ROUTER_ADDRESS), abi=uniswap_v2_router_abi)
+        except Exception as e:
+            if tx_hash is None:
+                nonce_manager.handle_send_error(account.address, nonce, e)
+            if 'nonce too low' in str(e):
+                print(f"  {Colors.YELLOW}⚠️ nonce已被占用，已从链上重新同步nonce并重试...{Colors.RESET}")
+            elif 'replacement transaction underpriced' in str(e):
+                fees = fee_oracle.replacement_fees(fees)
+                print(f"  {Colors.YELLOW}⚠️ Gas价格过低，增加到 {fee_oracle.describe(fees)} 并重试...{Colors.RESET}")
+            elif 'out of gas' in str(e) and gas_limit is not None:
+                gas_estimator.bump("swap_eth_for_tokens", token_address_to_swap, gas_limit)
+                print(f"  {Colors.RED}🔥 交易Gas上限 {gas_limit} 不足，已提高Gas上限并重试...{Colors.RESET}")
+            elif 'EXPIRED' in str(e) and not expired:
+                expired = True
+                block_clock.refresh()
+                print(f"  {Colors.YELLOW}⚠️ 交易已过截止时间，已重新读取最新区块时间并重试...{Colors.RESET}")
+            else:
+                print(f"  {Colors.RED}❌ 交易过程中发生错误: {e}{Colors.RESET}")
+                raise
 
-def swap_eth_for_tokens(account, private_key, amount_in_wei, amount_out_min, deadline, token_address_to_swap):
-    path = [web3.to_checksum_address("0xfAdf8E61BE6e95790d627057251AA41258a207d0"),
-            web3.to_checksum_address(token_address_to_swap)]
+async def swap_eth_for_tokens_async(async_web3, account, private_key, amount_in_wei, amount_out_min, token_address_to_swap):
+    path = [WETH_ADDRESS, token_address_to_swap]
 
-    gas_price = web3.eth.gas_price
+    fees = await fee_oracle.fees_async(async_web3)
 
+    expired = False
     while True:
+        nonce = None
+        tx_hash = None
+        gas_limit = None
         try:
-            nonce = web3.eth.get_transaction_count(account.address, "pending")
-
-            transaction = uniswap_router.functions.swapExactETHForTokens(
-                amount_out_min,
-                path,
-                account.address,
-                deadline
-            ).build_transaction({
+            nonce = await nonce_manager.allocate_async(account.address, async_web3)
+
+            call = {
                 'from': account.address,
+                'to': UNISWAP_V2_ROUTER_ADDRESS,
                 'value': amount_in_wei,
-                'gas': 200000,
-                'gasPrice': gas_price,
+                'data': calldata.encode("swapExactETHForTokens", amount_out_min, path, account.address, block_clock.deadline())
+            }
+            gas_limit = await gas_estimator.limit_async("swap_eth_for_tokens", token_address_to_swap, lambda: async_web3.eth.estimate_gas(call), 200000)
+            transaction = {
+                **call,
+                'gas': gas_limit,
+                **fees,
                 'nonce': nonce,
                 'chainId': CHAIN_ID
-            })
+            }
 
-            signed_txn = web3.eth.account.sign_transaction(transaction, private_key=private_key)
-            tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction)
-            print(f"  {Colors.GREEN}✅ {Colors.BOLD}交易已发送{Colors.RESET}")
+            raw_transaction = await signer.sign_async(transaction, private_key)
+            tx_hash = await async_web3.eth.send_raw_transaction(raw_transaction)
+            nonce_manager.sent(account.address, nonce, tx_hash)
+            receipt_tracker.track(tx_hash, gas_estimator.receipt_callback("swap_eth_for_tokens", token_address_to_swap, gas_limit))
+            print(f"  {Colors.GREEN}✅ {Colors.BOLD}账户 {account.address} 交易已发送{Colors.RESET}")
             return web3.to_hex(tx_hash)
 
         except Exception as e:
-            if 'replacement transaction underpriced' in str(e) or 'nonce too low' in str(e):
-                gas_price += web3.to_wei(2, 'gwei')
-                print(f"  {Colors.YELLOW}⚠️ Gas价格过低或nonce问题，增加到 {web3.from_wei(gas_price, 'gwei')} gwei 并重试...{Colors.RESET}")
-            elif 'out of gas' in str(e):
-                gas_price += web3.to_wei(5, 'gwei')
-                print(f"  {Colors.RED}🔥 交易Gas不足，增加到 {web3.from_wei(gas_price, 'gwei')} gwei 并重试...{Colors.RESET}")
+            if tx_hash is None:
+                await nonce_manager.handle_send_error_async(account.address, nonce, e, async_web3)
+            if 'nonce too low' in str(e):
+                print(f"  {Colors.YELLOW}⚠️ nonce已被占用，已从链上重新同步nonce并重试...{Colors.RESET}")
+            elif 'replacement transaction underpriced' in str(e):
+                fees = await fee_oracle.replacement_fees_async(fees, async_web3)
+                print(f"  {Colors.YELLOW}⚠️ Gas价格过低，增加到 {fee_oracle.describe(fees)} 并重试...{Colors.RESET}")
+            elif 'out of gas' in str(e) and gas_limit is not None:
+                gas_estimator.bump("swap_eth_for_tokens", token_address_to_swap, gas_limit)
+                print(f"  {Colors.RED}🔥 交易Gas上限 {gas_limit} 不足，已提高Gas上限并重试...{Colors.RESET}")
+            elif 'EXPIRED' in str(e) and not expired:
+                expired = True
+                await block_clock.refresh_async()
+                print(f"  {Colors.YELLOW}⚠️ 交易已过截止时间，已重新读取最新区块时间并重试...{Colors.RESET}")
             else:
-                print(f"  {Colors.RED}❌ 交易过程中发生错误: {e}{Colors.RESET}")
+                print(f"  {Colors.RED}❌ 账户 {account.address} 交易过程中发生错误: {e}{Colors.RESET}")
                 raise
 
-if __name__ == "__main__":
+def main():
+    global SELECTED_TOKEN_NAME, TOKEN_ADDRESS
+    warm_up()
     print(f"{Colors.BOLD}{Colors.MAGENTA}--- 🚀 Nexswap NEX兑换代币机器人 🚀 ---{Colors.RESET}")
 
     min_eth = 0.0
@@ -97,7 +144,7 @@ if __name__ == "__main__":
             raise ValueError("无效的NEX范围。请确保输入正值且最小值≤最大值。")
     except ValueError as e:
         print(f"{Colors.RED}错误: {e}{Colors.RESET}")
-        exit()
+        return
 
     print(f"\n{Colors.BOLD}{Colors.BLUE}--- 选择要兑换的代币 ---{Colors.RESET}")
     token_names = list(AVAILABLE_TOKENS.keys())
@@ -131,57 +178,81 @@ if __name__ == "__main__":
         else:
             print(f"{Colors.RED}无效的选择。请输入'y'或'n'。{Colors.RESET}")
 
-    amount_out_min = 0
-
-    deadline = int(web3.eth.get_block('latest').timestamp) + 300
+    concurrency = 0
+    while True:
+        mode_choice = input(f"{Colors.CYAN}选择执行模式:\n1. 顺序模式(逐个账户)\n2. 并发模式(多个账户同时执行)\n选择模式 (1或2): {Colors.RESET}").strip()
+        if mode_choice == '1':
+            print(f"{Colors.GREEN}✅ 顺序模式已选择，同时最多执行 {MAX_INFLIGHT} 个步骤(可用--max-inflight调整)，钱包等待期间执行其他钱包。{Colors.RESET}")
+            break
+        elif mode_choice == '2':
+            try:
+                concurrency = int(input(f"{Colors.CYAN}输入最大并发钱包数量(例如: 10): {Colors.RESET}"))
+                if concurrency < 1:
+                    raise ValueError("并发数量必须至少为1。")
+                print(f"{Colors.GREEN}✅ 并发模式已选择，最多同时执行 {concurrency} 个钱包。{Colors.RESET}")
+                break
+            except ValueError as e:
+                print(f"{Colors.RED}无效输入: {e}{Colors.RESET}")
+        else:
+            print(f"{Colors.RED}无效的选择。请输入'1'或'2'。{Colors.RESET}")
 
-    accounts = [web3.eth.account.from_key(pk) for pk in PRIVATE_KEYS]
-    account_index = 0
+    amount_out_min = 0
 
-    def has_sufficient_balance(account, amount_in_wei):
-        balance = web3.eth.get_balance(account.address)
-        return balance >= amount_in_wei
+    accounts = wallet_index.accounts()
 
-    print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 开始兑换操作 ---{Colors.RESET}")
+    balance_snapshot = None
 
-    if run_in_loop:
-        while True:
-            try:
-                current_account = accounts[account_index]
-                current_private_key = PRIVATE_KEYS[account_index]
+    def take_balance_snapshot():
+        try:
+            return batch_reader.snapshot([account.address for account in accounts])
+        except Exception as e:
+            print(f"  {Colors.YELLOW}⚠️ 批量读取余额失败: {e}，将逐个查询余额。{Colors.RESET}")
+            return None
 
-                eth_amount = round(random.uniform(min_eth, max_eth), 4)
-                amount_in_wei = web3.to_wei(eth_amount, 'ether')
+    def get_eth_balance(account):
+        if balance_snapshot is not None:
+            return balance_snapshot.eth_balance(account.address)
+        return web3.eth.get_balance(account.address)
 
-                print(f"\n{Colors.WHITE}🔄 {Colors.BOLD}准备为账户执行兑换:{Colors.RESET}{Colors.WHITE} {current_account.address}{Colors.RESET}")
-                print(f"{Colors.WHITE}   尝试将 {Colors.BOLD}{eth_amount} NEX{Colors.RESET}{Colors.WHITE} 兑换为 {SELECTED_TOKEN_NAME}...{Colors.RESET}")
+    def has_sufficient_balance(account, amount_in_wei):
+        return get_eth_balance(account) >= amount_in_wei
 
-                if not has_sufficient_balance(current_account, amount_in_wei):
-                    current_balance = web3.from_wei(web3.eth.get_balance(current_account.address), 'ether')
-                    print(f"  {Colors.RED}❌ {Colors.BOLD}账户 {current_account.address} 余额不足{Colors.RESET}{Colors.RED}。余额: {current_balance} NEX。跳过此账户。{Colors.RESET}")
-                    account_index = (account_index + 1) % len(accounts)
-                    time.sleep(1)
-                    continue
+    print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 开始兑换操作 ---{Colors.RESET}")
 
-                tx_hash = swap_eth_for_tokens(current_account, current_private_key, amount_in_wei, amount_out_min, deadline, TOKEN_ADDRESS)
-                print(f"{Colors.GREEN}  🎉 {Colors.BOLD}成功兑换 {eth_amount} NEX{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{tx_hash}{Colors.RESET}")
+    if concurrency > 0:
+        async_web3 = create_async_web3(transport, concurrency)
 
-                delay = random.randint(5, 15)
-                print(f"{Colors.YELLOW}  😴 等待 {delay} 秒后进行下一笔交易...{Colors.RESET}")
-                time.sleep(delay)
+        async def swap_wallet(account, private_key):
+            eth_amount = round(random.uniform(min_eth, max_eth), 4)
+            amount_in_wei = web3.to_wei(eth_amount, 'ether')
 
-                account_index = (account_index + 1) % len(accounts)
+            print(f"\n{Colors.WHITE}🔄 {Colors.BOLD}准备为账户执行兑换:{Colors.RESET}{Colors.WHITE} {account.address} ({eth_amount} NEX → {SELECTED_TOKEN_NAME}){Colors.RESET}")
 
-            except Exception as e:
-                print(f"  {Colors.RED}❌ 账户 {accounts[account_index].address} 兑换过程中发生意外错误: {e}{Colors.RESET}")
-                print(f"{Colors.YELLOW}  短暂暂停后转到下一个账户...{Colors.RESET}")
-                account_index = (account_index + 1) % len(accounts)
-                time.sleep(5)
+            if balance_snapshot is not None:
+                balance = balance_snapshot.eth_balance(account.address)
+            else:
+                balance = await async_web3.eth.get_balance(account.address)
+            if balance < amount_in_wei:
+                print(f"  {Colors.RED}❌ {Colors.BOLD}账户 {account.address} 余额不足{Colors.RESET}{Colors.RED}。余额: {web3.from_wei(balance, 'ether')} NEX。跳过此账户。{Colors.RESET}")
+                return False
+
+            tx_hash = await swap_eth_for_tokens_async(async_web3, account, private_key, amount_in_wei, amount_out_min, TOKEN_ADDRESS)
+            print(f"{Colors.GREEN}  🎉 {Colors.BOLD}账户 {account.address} 成功兑换 {eth_amount} NEX{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{tx_hash}{Colors.RESET}")
+            return True
+
+        def start_round():
+            nonlocal balance_snapshot
+            balance_snapshot = take_balance_snapshot()
+
+        AsyncWalletExecutor(concurrency, 5, 15).run(accounts, PRIVATE_KEYS, swap_wallet, run_in_loop, start_round)
+        if not run_in_loop:
+            print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 所有单次兑换已完成 ---{Colors.RESET}")
     else:
-        for i in range(len(accounts)):
+        def swap_steps(position):
+            # 一个钱包一轮的步骤，等待时yield间隔秒数，由调度器在此期间执行其他钱包
+            current_account = accounts[position]
             try:
-                current_account = accounts[account_index]
-                current_private_key = PRIVATE_KEYS[account_index]
+                current_private_key = PRIVATE_KEYS[position]
 
                 eth_amount = round(random.uniform(min_eth, max_eth), 4)
                 amount_in_wei = web3.to_wei(eth_amount, 'ether')
@@ -190,25 +261,29 @@ if __name__ == "__main__":
                 print(f"{Colors.WHITE}   尝试将 {Colors.BOLD}{eth_amount} NEX{Colors.RESET}{Colors.WHITE} 兑换为 {SELECTED_TOKEN_NAME}...{Colors.RESET}")
 
                 if not has_sufficient_balance(current_account, amount_in_wei):
-                    current_balance = web3.from_wei(web3.eth.get_balance(current_account.address), 'ether')
+                    current_balance = web3.from_wei(get_eth_balance(current_account), 'ether')
                     print(f"  {Colors.RED}❌ {Colors.BOLD}账户 {current_account.address} 余额不足{Colors.RESET}{Colors.RED}。余额: {current_balance} NEX。跳过此账户。{Colors.RESET}")
-                    account_index = (account_index + 1) % len(accounts)
-                    time.sleep(1)
-                    continue
+                    return False
 
-                tx_hash = swap_eth_for_tokens(current_account, current_private_key, amount_in_wei, amount_out_min, deadline, TOKEN_ADDRESS)
+                tx_hash = swap_eth_for_tokens(current_account, current_private_key, amount_in_wei, amount_out_min, TOKEN_ADDRESS)
                 print(f"{Colors.GREEN}  🎉 {Colors.BOLD}成功兑换 {eth_amount} NEX{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{tx_hash}{Colors.RESET}")
+            except Exception as e:
+                print(f"  {Colors.RED}❌ 账户 {current_account.address} 兑换过程中发生意外错误: {e}{Colors.RESET}")
+                return False
+
+            if run_in_loop:
+                delay = random.randint(5, 15)
+                print(f"{Colors.YELLOW}  😴 账户 {current_account.address} 等待 {delay} 秒后进行下一笔交易...{Colors.RESET}")
+                yield delay
+            return True
 
-                if i < len(accounts) - 1:
-                    delay = random.randint(5, 15)
-                    print(f"{Colors.YELLOW}  😴 等待 {delay} 秒后进行下一笔交易...{Colors.RESET}")
-                    time.sleep(delay)
+        def start_round():
+            nonlocal balance_snapshot
+            balance_snapshot = take_balance_snapshot()
 
-                account_index = (account_index + 1) % len(accounts)
+        StepScheduler(MAX_INFLIGHT).run(len(accounts), swap_steps, run_in_loop, start_round)
+        if not run_in_loop:
+            print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 所有单次兑换已完成 ---{Colors.RESET}")
 
-            except Exception as e:
-                print(f"  {Colors.RED}❌ 账户 {accounts[account_index].address} 兑换过程中发生意外错误: {e}{Colors.RESET}")
-                print(f"{Colors.YELLOW}  短暂暂停后转到下一个账户...{Colors.RESET}")
-                account_index = (account_index + 1) % len(accounts)
-                time.sleep(5)
-        print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 所有单次兑换已完成 ---{Colors.RESET}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+import asyncio
+import heapq
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from eth_utils import keccak
+from web3 import AsyncHTTPProvider, HTTPProvider
+
+# 多节点RPC传输层: 每个节点一个保持长连接的连接池，按实时延迟和错误率给节点打分，
+# 请求优先发往得分最好的节点；节点超时、限流或5xx时自动切换到下一个节点重试同一个请求
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+RATE_LIMIT_CODES = {-32005, -32029}
+EWMA_WEIGHT = 0.2
+MAX_COOLDOWN = 60
+LATENCY_WINDOW = 100
+# 只对幂等的只读请求做对冲，发送交易等写请求永远只发一次
+HEDGE_METHODS = {
+    "eth_blockNumber", "eth_call", "eth_chainId", "eth_estimateGas", "eth_feeHistory", "eth_gasPrice",
+    "eth_getBalance", "eth_getBlockByNumber", "eth_getBlockReceipts", "eth_getCode", "eth_getLogs",
+    "eth_getTransactionCount", "eth_getTransactionReceipt", "eth_maxPriorityFeePerGas",
+}
+HEDGE_MIN_DELAY = 0.05
+HEDGE_DEFAULT_DELAY = 0.5
+# 没有其他节点可以切换时，被限流的请求按指数退避重试的次数和初始等待秒数
+RATE_LIMIT_RETRIES = 4
+RATE_LIMIT_BACKOFF = 0.5
+
+# 请求优先级，数字越小越先发送: 发送交易和nonce查询优先于手续费/收据，最后才是余额和报价
+PRIORITY_SEND = 0
+PRIORITY_CRITICAL = 1
+PRIORITY_READ = 2
+METHOD_PRIORITY = {
+    "eth_sendRawTransaction": PRIORITY_SEND,
+    "eth_getTransactionCount": PRIORITY_SEND,
+    "eth_chainId": PRIORITY_CRITICAL,
+    "eth_estimateGas": PRIORITY_CRITICAL,
+    "eth_feeHistory": PRIORITY_CRITICAL,
+    "eth_gasPrice": PRIORITY_CRITICAL,
+    "eth_maxPriorityFeePerGas": PRIORITY_CRITICAL,
+    "eth_getTransactionReceipt": PRIORITY_CRITICAL,
+    "eth_getBlockReceipts": PRIORITY_CRITICAL,
+}
+
+class RetryableRPCError(Exception):
+    pass
+
+class RateLimitedError(RetryableRPCError):
+    pass
+
+class RateLimiter:
+    # 令牌桶限制每秒请求数，同时限制同时进行的请求数；
+    # 等待的请求按优先级排队，同一优先级先到先得
+    def __init__(self, requests_per_second=None, max_concurrency=None):
+        self.rate = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.tokens = float(requests_per_second or 0)
+        self.updated_at = time.monotonic()
+        self.inflight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(float(self.rate), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _delay(self):
+        # 可以放行时返回0，否则返回下一个令牌需要等待的秒数(None表示等待其他请求完成)
+        if self.max_concurrency and self.inflight >= self.max_concurrency:
+            return None
+        if self.rate and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def acquire(self, priority=PRIORITY_READ):
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill(time.monotonic())
+                    delay = self._delay()
+                    if self._waiters[0] == entry and delay == 0:
+                        heapq.heappop(self._waiters)
+                        if self.rate:
+                            self.tokens -= 1
+                        self.inflight += 1
+                        self._condition.notify_all()
+                        return
+                    self._condition.wait(delay if self._waiters[0] == entry else None)
+            except BaseException:
+                # 等待中被中断(例如Ctrl+C)时移出队列，避免堵住后面的请求
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._condition.notify_all()
+                raise
+
+    def release(self):
+        with self._condition:
+            self.inflight -= 1
+            self._condition.notify_all()
+
+    def throttled(self):
+        # 节点返回限流时清空令牌，让排队的请求稍后再发
+        with self._condition:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0)
+
+    def queued(self):
+        with self._condition:
+            return len(self._waiters)
+
+class Endpoint:
+    def __init__(self, url, pool_size, timeout, requests_per_second=None, max_concurrency=None):
+        self.url = url
+        self.timeout = timeout
+        self.limiter = RateLimiter(requests_per_second, max_concurrency or pool_size)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.latency = None
+        self.samples = {}
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0
+
+    def score(self):
+        # 分数越小越好: 平滑延迟 * 错误率惩罚，还没有数据的节点优先尝试一次
+        latency = self.latency if self.latency is not None else 0
+        return latency * (1 + 4 * self.error_rate)
+
+    def p95(self, method=None):
+        # 按方法分别统计，eth_getLogs这类慢方法不会拉高eth_call的对冲等待时间
+        samples = self.samples.get(method, ())
+        if len(samples) < 5:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def is_cooling(self, now):
+        return now < self.cooldown_until
+
+    def record_success(self, elapsed, method=None):
+        self.latency = elapsed if self.latency is None else (1 - EWMA_WEIGHT) * self.latency + EWMA_WEIGHT * elapsed
+        samples = self.samples.get(method)
+        if samples is None:
+            samples = self.samples[method] = deque(maxlen=LATENCY_WINDOW)
+        samples.append(elapsed)
+        self.error_rate *= 1 - EWMA_WEIGHT
+        self.consecutive_failures = 0
+        self.cooldown_until = 0
+
+    def record_failure(self):
+        self.error_rate = (1 - EWMA_WEIGHT) * self.error_rate + EWMA_WEIGHT
+        self.consecutive_failures += 1
+        self.cooldown_until = time.monotonic() + min(2 ** self.consecutive_failures, MAX_COOLDOWN)
+
+def _is_rate_limited(content):
+    # 部分节点限流时返回HTTP 200和JSON-RPC错误
+    if b'"error"' not in content:
+        return False
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return False
+    for item in data if isinstance(data, list) else [data]:
+        error = item.get("error") if isinstance(item, dict) else None
+        if error and (error.get("code") in RATE_LIMIT_CODES or "rate limit" in str(error.get("message", "")).lower()):
+            return True
+    return False
+
+class HedgeStats:
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved = 0.0
+
+class EndpointPool:
+    def __init__(self, urls, pool_size=20, timeout=30, hedge=False, requests_per_second=None, max_concurrency=None):
+        # hedge: 只读请求在主节点超过其p95延迟仍未返回时，同时发给第二个节点，先返回的结果生效
+        # requests_per_second/max_concurrency: 每个节点的请求速率和并发上限，None表示不限制速率、并发数等于连接池大小
+        if not urls:
+            raise ValueError("至少需要一个RPC节点")
+        self.endpoints = [Endpoint(url, pool_size, timeout, requests_per_second, max_concurrency) for url in urls]
+        self.hedge = hedge
+        self._lock = threading.Lock()
+        self._hedge_stats = {}
+        self._hedge_executor = None
+
+    def ranked(self):
+        # 健康节点按分数排序，冷却中的节点放在最后作为兜底
+        now = time.monotonic()
+        with self._lock:
+            healthy = sorted((e for e in self.endpoints if not e.is_cooling(now)), key=Endpoint.score)
+            cooling = sorted((e for e in self.endpoints if e.is_cooling(now)), key=lambda e: e.cooldown_until)
+        return healthy + cooling
+
+    def _post_to(self, endpoint, data, priority=PRIORITY_READ, method=None, started=None):
+        # 成功返回(响应内容, 耗时)，失败时记录到节点健康分数后抛出异常；耗时不包括排队时间。
+        # started: 通过限流器、真正开始发送时设置的threading.Event
+        endpoint.limiter.acquire(priority)
+        if started is not None:
+            started.set()
+        start = time.perf_counter()
+        try:
+            response = endpoint.session.post(endpoint.url, data=data, timeout=endpoint.timeout)
+            if response.status_code == 429 or _is_rate_limited(response.content):
+                endpoint.limiter.throttled()
+                raise RateLimitedError("节点限流")
+            if response.status_code in RETRYABLE_STATUS:
+                raise RetryableRPCError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+        except (requests.RequestException, RetryableRPCError):
+            with self._lock:
+                endpoint.record_failure()
+            raise
+        finally:
+            endpoint.limiter.release()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            endpoint.record_success(elapsed, method)
+        return response.content, elapsed
+
+    def _post_with_backoff(self, endpoint, data, priority=PRIORITY_READ, method=None):
+        # 没有其他节点可以切换时，被限流后按指数退避等待，再重试同一个节点
+        for retry in range(RATE_LIMIT_RETRIES):
+            try:
+                return self._post_to(endpoint, data, priority, method)
+            except RateLimitedError:
+                time.sleep(min(RATE_LIMIT_BACKOFF * 2 ** retry, MAX_COOLDOWN))
+        return self._post_to(endpoint, data, priority, method)
+
+    def post_raw(self, data, method=None):
+        # 返回(响应内容, 尝试过的节点数)；method为请求的方法名，批量请求传"batch"
+        endpoints = self.ranked()
+        methods = self._methods(method, data)
+        priority = min(METHOD_PRIORITY.get(name, PRIORITY_READ) for name in methods)
+        if self.hedge and len(endpoints) > 1 and all(name in HEDGE_METHODS for name in methods):
+            try:
+                return self._post_hedged(endpoints[0], endpoints[1], data, method, priority), 2
+            except (requests.RequestException, RetryableRPCError) as e:
+                last_error = f"{endpoints[0].url}, {endpoints[1].url}: {e}"
+                endpoints = endpoints[2:]
+        else:
+            last_error = None
+        for attempt, endpoint in enumerate(endpoints, start=1):
+            post = self._post_with_backoff if attempt == len(endpoints) else self._post_to
+            try:
+                content, _ = post(endpoint, data, priority, method)
+            except (requests.RequestException, RetryableRPCError) as e:
+                last_error = f"{endpoint.url}: {e}"
+                continue
+            return content, attempt
+        raise ConnectionError(f"所有RPC节点均请求失败，最后的错误: {last_error}")
+
+    def _methods(self, method, data):
+        if method == "batch":
+            try:
+                return [item["method"] for item in json.loads(data)] or [None]
+            except (ValueError, KeyError, TypeError):
+                return [None]
+        return [method]
+
+    def _post_hedged(self, primary, secondary, data, method, priority):
+        with self._lock:
+            if self._hedge_executor is None:
+                # 线程数不超过所有节点的并发上限之和，更多的线程也只会在限流器中排队
+                workers = sum(endpoint.limiter.max_concurrency for endpoint in self.endpoints)
+                self._hedge_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rpc-hedge")
+            stats = self._hedge_stats.setdefault(method, HedgeStats())
+            stats.requests += 1
+            delay = primary.p95(method)
+        delay = HEDGE_DEFAULT_DELAY if delay is None else max(delay, HEDGE_MIN_DELAY)
+
+        started = threading.Event()
+        first = self._hedge_executor.submit(self._post_to, primary, data, priority, method, started)
+        first.add_done_callback(lambda future: started.set())
+        # 从请求真正发出时开始计时: 在执行器或限流器中排队不算慢，不会在节点繁忙时再增加一份请求
+        started.wait()
+        start = time.perf_counter()
+        done, _ = wait([first], timeout=delay)
+        if done and first.exception() is None:
+            return first.result()[0]
+        if done:
+            # 主节点直接失败时不算对冲，和普通的故障切换一样改用第二个节点
+            return self._post_to(secondary, data, priority, method)[0]
+
+        with self._lock:
+            stats.hedged += 1
+        second = self._hedge_executor.submit(self._post_to, secondary, data, priority, method)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is second:
+                    won_at = time.perf_counter() - start
+                    with self._lock:
+                        stats.hedge_wins += 1
+                    # 主节点之后返回时，记录对冲节省的时间
+                    first.add_done_callback(lambda f: self._record_saved(stats, f, start, won_at))
+                return future.result()[0]
+        raise error
+
+    def _record_saved(self, stats, future, start, won_at):
+        if future.exception() is None:
+            with self._lock:
+                stats.saved += max(time.perf_counter() - start - won_at, 0)
+
+    def hedge_report(self):
+        # 每个方法: 请求数、触发对冲次数、对冲节点先返回的次数和累计节省的时间
+        with self._lock:
+            return {
+                method: {"requests": s.requests, "hedged": s.hedged, "hedge_wins": s.hedge_wins, "saved": s.saved}
+                for method, s in self._hedge_stats.items()
+            }
+
+    def post_json(self, payload):
+        method = "batch" if isinstance(payload, list) else payload.get("method")
+        content, _ = self.post_raw(json.dumps(payload).encode(), method)
+        return json.loads(content)
+
+    def health(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "url": e.url, "latency": e.latency, "error_rate": e.error_rate, "cooling": e.is_cooling(now),
+                    "inflight": e.limiter.inflight, "queued": e.limiter.queued(),
+                }
+                for e in self.endpoints
+            ]
+
+def _already_known_result(request_data, content):
+    # 节点返回"already known"说明同一笔交易(相同的哈希)已经在交易池中，例如第一个节点超时但其实已经收到交易、
+    # 换节点重发时，这种情况按发送成功处理并返回交易哈希，避免上层重新分配nonce
+    if b"already known" not in content:
+        return None
+    try:
+        request = json.loads(request_data)
+        response = json.loads(content)
+    except ValueError:
+        return None
+    error = response.get("error") if isinstance(response, dict) else None
+    if not error or "already known" not in str(error.get("message", "")).lower():
+        return None
+    raw_transaction = bytes.fromhex(request["params"][0][2:])
+    return json.dumps({"jsonrpc": "2.0", "id": request.get("id"), "result": "0x" + keccak(raw_transaction).hex()}).encode()
+
+def _sorted_batch(response):
+    if not isinstance(response, list):
+        return response
+    return sorted(response, key=lambda item: item.get("id", 0))
+
+class FailoverHTTPProvider(HTTPProvider):
+    def __init__(self, pool, **kwargs):
+        super().__init__(pool.endpoints[0].url, **kwargs)
+        self.pool = pool
+
+    def _make_request(self, method, request_data):
+        content, _ = self.pool.post_raw(request_data, method)
+        if method == "eth_sendRawTransaction":
+            content = _already_known_result(request_data, content) or content
+        return content
+
+    def make_batch_request(self, batch_requests):
+        request_data = self.encode_batch_rpc_request(batch_requests)
+        content, _ = self.pool.post_raw(request_data, "batch")
+        return _sorted_batch(self.decode_rpc_response(content))
+
+class AsyncFailoverHTTPProvider(AsyncHTTPProvider):
+    # 复用同步连接池，在线程中发送请求，并发钱包和同步代码共享节点健康分数。
+    # 使用自己的线程池而不是asyncio默认的(最多min(32, CPU数+4)个线程)，同时进行的请求数由max_workers决定，
+    # 默认等于所有节点的并发上限之和
+    def __init__(self, pool, max_workers=None, **kwargs):
+        super().__init__(pool.endpoints[0].url, **kwargs)
+        self.pool = pool
+        workers = max_workers or sum(endpoint.limiter.max_concurrency for endpoint in pool.endpoints)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rpc-async")
+
+    async def _post(self, request_data, method):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.pool.post_raw, request_data, method)
+
+    async def _make_request(self, method, request_data):
+        content, _ = await self._post(request_data, method)
+        if method == "eth_sendRawTransaction":
+            content = _already_known_result(request_data, content) or content
+        return content
+
+    async def make_batch_request(self, batch_requests):
+        request_data = self.encode_batch_rpc_request(batch_requests)
+        content, _ = await self._post(request_data, "batch")
+        return _sorted_batch(self.decode_rpc_response(content))
+
+def _self_check():
+    # 本地模拟JSON-RPC节点: 返回503的节点、正常节点和响应很慢的节点，
+    # 检查请求能切换到正常节点，以及开启对冲后慢节点不会拖慢只读请求
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from web3 import Web3
+
+    class FailingHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(503)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    class HealthyHandler(FailingHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests_list = request if isinstance(request, list) else [request]
+            results = [{"jsonrpc": "2.0", "id": item["id"], "result": "0x10"} for item in requests_list]
+            body = json.dumps(results if isinstance(request, list) else results[0]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    class SlowHandler(HealthyHandler):
+        def do_POST(self):
+            time.sleep(1)
+            super().do_POST()
+
+    class ThrottlingHandler(HealthyHandler):
+        # 前两个请求返回429
+        throttled = 0
+
+        def do_POST(self):
+            if ThrottlingHandler.throttled < 2:
+                ThrottlingHandler.throttled += 1
+                self.rfile.read(int(self.headers["Content-Length"]))
+                self.send_response(429)
+                self.end_headers()
+                return
+            super().do_POST()
+
+    handlers = (FailingHandler, HealthyHandler, SlowHandler, ThrottlingHandler)
+    servers = [ThreadingHTTPServer(("127.0.0.1", 0), handler) for handler in handlers]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        urls = [f"http://127.0.0.1:{server.server_port}" for server in servers]
+        pool = EndpointPool(urls[:2], timeout=5)
+        web3 = Web3(FailoverHTTPProvider(pool))
+        assert web3.eth.block_number == 16
+        assert pool.ranked()[0] is pool.endpoints[1]
+        assert pool.health()[0]["cooling"]
+        assert pool.post_json([{"jsonrpc": "2.0", "id": 0, "method": "eth_blockNumber", "params": []}])[0]["result"] == "0x10"
+        print("✅ 节点切换检查通过:", pool.health())
+
+        hedged_pool = EndpointPool([urls[2], urls[1]], timeout=5, hedge=True)
+        start = time.perf_counter()
+        assert Web3(FailoverHTTPProvider(hedged_pool)).eth.block_number == 16
+        elapsed = time.perf_counter() - start
+        time.sleep(0.7)
+        report = hedged_pool.hedge_report()["eth_blockNumber"]
+        assert elapsed < 0.9 and report["hedged"] == 1 and report["hedge_wins"] == 1 and report["saved"] > 0.3
+        print(f"✅ 对冲请求检查通过: 耗时 {elapsed:.2f} 秒", report)
+
+        limited_pool = EndpointPool([urls[1]], timeout=5, requests_per_second=10)
+        start = time.perf_counter()
+        for _ in range(20):
+            limited_pool.post_json({"jsonrpc": "2.0", "id": 0, "method": "eth_blockNumber", "params": []})
+        elapsed = time.perf_counter() - start
+        assert 0.9 < elapsed < 1.5
+        print(f"✅ 限速检查通过: 20个请求(10次/秒, 突发10个)耗时 {elapsed:.2f} 秒")
+
+        single_pool = EndpointPool([urls[3]], timeout=5)
+        start = time.perf_counter()
+        assert single_pool.post_json({"jsonrpc": "2.0", "id": 0, "method": "eth_blockNumber", "params": []})["result"] == "0x10"
+        elapsed = time.perf_counter() - start
+        assert ThrottlingHandler.throttled == 2 and elapsed >= RATE_LIMIT_BACKOFF * 3
+        print(f"✅ 限流退避检查通过: 只有一个节点时被限流两次后重试成功，耗时 {elapsed:.2f} 秒")
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    # 并发上限为1时，排队的请求按优先级而不是到达顺序放行
+    limiter = RateLimiter(max_concurrency=1)
+    limiter.acquire()
+    order = []
+
+    def queued_request(priority):
+        limiter.acquire(priority)
+        order.append(priority)
+        limiter.release()
+
+    threads = []
+    for priority in (PRIORITY_READ, PRIORITY_CRITICAL, PRIORITY_SEND):
+        thread = threading.Thread(target=queued_request, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        while limiter.queued() < len(threads):
+            time.sleep(0.01)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == [PRIORITY_SEND, PRIORITY_CRITICAL, PRIORITY_READ]
+    print("✅ 优先级检查通过: 发送交易 > 手续费/收据 > 余额/报价")
+
+if __name__ == "__main__":
+    _self_check()
@@ -1,8 +1,13 @@
-import os
 import random
-import time
-from web3 import Web3
-from dotenv import load_dotenv
+from core import (
+    PRIVATE_KEYS, CHAIN_ID, MAX_INFLIGHT, UNISWAP_V2_ROUTER_ADDRESS, WETH_ADDRESS,
+    AVAILABLE_TOKENS, ERC20_ABI, transport, web3, nonce_manager, wallet_index, signer, calldata,
+    batch_reader, allowance_ledger, block_clock, receipt_tracker, gas_estimator, fee_oracle,
+    metadata, erc20_contract, warm_up,
+)
+from metadata import from_base_units, to_base_units
+from wallet_executor import AsyncWalletExecutor, create_async_web3
+from scheduler import StepScheduler
 
 class Colors:
     RESET = "\033[0m"          # 重置颜色
@@ -16,161 +21,240 @@ class Colors:
     BOLD = "\033[1m"           # 加粗
     UNDERLINE = "\033[4m"      # 下划线
 
-load_dotenv()
-
-PRIVATE_KEYS = os.getenv("PRIVATE_KEYS").split(",")
-if not PRIVATE_KEYS:
-    raise ValueError(f"{Colors.RED}未在.env文件中找到私钥{Colors.RESET}")
-
-RPC_URL = "https://testnet3.rpc.nexus.xyz"
-CHAIN_ID = 3940
-
-UNISWAP_V2_ROUTER_ADDRESS = "0x32aA9448586b06d2d42Fe4CFabF1c7AcD03bAE31"
-WETH_ADDRESS = "0xfAdf8E61BE6e95790d627057251AA41258a207d0"
-
-AVAILABLE_TOKENS = {
-    "NXS": "0x3eC55271351865ab99a9Ce92272C3E908f2E627b",
-    "NEXI": "0x184eE44cF8B7Fec2371dc46D9076fFB2c1E0Ce65",
-    "AIE": "0xF6f61565947621387ADF3BeD7ba02533aB013CCd"
-}
-
 TOKEN_ADDRESS = ""
 SELECTED_TOKEN_NAME = ""
-
-web3 = Web3(Web3.HTTPProvider(RPC_URL))
-if not web3.is_connected():
-    raise ConnectionError(f"{Colors.RED}无法连接到RPC URL{Colors.RESET}")
-
-uniswap_v2_router_abi = '''
-[
-    {
-        "inputs": [
-            {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
-            {"internalType": "uint256", "name": "amountOutMin", "type": "uint256"},
-            {"internalType": "address[]", "name": "path", "type": "address[]"},
-            {"internalType": "address", "name": "to", "type": "address"},
-            {"internalType": "uint256", "name": "deadline", "type": "uint256"}
-        ],
-        "name": "swapExactTokensForETH",
-        "outputs": [
-            {"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}
-        ],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
-'''
-
-erc20_abi = '''
-[
-    {
-        "constant": true,
-        "inputs": [{"name": "_owner", "type": "address"}],
-        "name": "balanceOf",
-        "outputs": [{"name": "balance", "type": "uint256"}],
-        "type": "function"
-    },
-    {
-        "constant": false,
-        "inputs": [
-            {"name": "_spender", "type": "address"},
-            {"name": "_value", "type": "uint256"}
-        ],
-        "name": "approve",
-        "outputs": [{"name": "", "type": "bool"}],
-        "type": "function"
-    }
-]
-'''
-
-uniswap_router = web3.eth.contract(address=Web3.to_checksum_address(UNISWAP_V2_ROUTER_ADDRESS), abi=uniswap_v2_router_abi)
+TOKEN_DECIMALS = 18
 
 def get_token_contract(token_address):
-    return web3.eth.contract(address=Web3.to_checksum_address(token_address), abi=erc20_abi)
+    return erc20_contract(token_address)
 
 def get_token_balance(account_address, token_address):
     token_contract = get_token_contract(token_address)
     return token_contract.functions.balanceOf(account_address).call()
 
 def approve_token(account, private_key, token_address, router_address, amount_to_approve):
-    token_contract = get_token_contract(token_address)
-    gas_price = web3.eth.gas_price
+    if not allowance_ledger.needs_approval(account.address, token_address, router_address, amount_to_approve):
+        print(f"  {Colors.CYAN}ℹ️ 路由器授权额度充足，跳过授权交易。{Colors.RESET}")
+        return True
+    amount_to_approve = allowance_ledger.approval_amount(amount_to_approve)
+    fees = fee_oracle.fees()
 
     while True:
+        nonce = None
+        tx_hash = None
+        gas_limit = None
         try:
-            nonce = web3.eth.get_transaction_count(account.address, "pending")
-            print(f"  {Colors.YELLOW}⏳ 正在为Uniswap路由器授权 {web3.from_wei(amount_to_approve, 'ether')} {SELECTED_TOKEN_NAME}...{Colors.RESET}")
+            nonce = nonce_manager.allocate(account.address)
+            print(f"  {Colors.YELLOW}⏳ 正在为Uniswap路由器授权 {from_base_units(amount_to_approve, metadata.decimals(token_address))} {SELECTED_TOKEN_NAME}...{Colors.RESET}")
 
-            transaction = token_contract.functions.approve(
-                router_address,
-                amount_to_approve
-            ).build_transaction({
+            call = {
                 'from': account.address,
-                'gas': 120000,
-                'gasPrice': gas_price,
+                'to': token_address,
+                'value': 0,
+                'data': calldata.encode("approve", router_address, amount_to_approve)
+            }
+            gas_limit = gas_estimator.limit("approve", token_address, lambda: web3.eth.estimate_gas(call), 120000)
+            transaction = {
+                **call,
+                'gas': gas_limit,
+                **fees,
                 'nonce': nonce,
                 'chainId': CHAIN_ID
-            })
+            }
 
-            signed_txn = web3.eth.account.sign_transaction(transaction, private_key=private_key)
-            tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction)
+            raw_transaction = signer.sign(transaction, private_key)
+            tx_hash = web3.eth.send_raw_transaction(raw_transaction)
+            nonce_manager.sent(account.address, nonce, tx_hash)
             print(f"  {Colors.GREEN}✅ {Colors.BOLD}授权交易已发送{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{web3.to_hex(tx_hash)}{Colors.RESET}")
-            web3.eth.wait_for_transaction_receipt(tx_hash, timeout=300)
+            receipt = receipt_tracker.wait(tx_hash, timeout=300)
+            gas_estimator.record("approve", token_address, receipt, gas_limit)
+            allowance_ledger.record_approval(account.address, token_address, router_address, amount_to_approve)
             print(f"{Colors.GREEN}  🎉 授权确认成功!{Colors.RESET}")
             return True
 
         except Exception as e:
-            if 'replacement transaction underpriced' in str(e) or 'nonce too low' in str(e):
-                gas_price += web3.to_wei(2, 'gwei')
-                print(f"  {Colors.YELLOW}⚠️ 授权交易Gas价格过低或nonce问题，增加到 {web3.from_wei(gas_price, 'gwei')} gwei并重试...{Colors.RESET}")
-            elif 'out of gas' in str(e):
-                gas_price += web3.to_wei(5, 'gwei')
-                print(f"  {Colors.RED}🔥 授权交易Gas不足，增加Gas价格至 {web3.from_wei(gas_price, 'gwei')} gwei并重试...{Colors.RESET}")
+            if tx_hash is None:
+                nonce_manager.handle_send_error(account.address, nonce, e)
+            if 'nonce too low' in str(e):
+                print(f"  {Colors.YELLOW}⚠️ nonce已被占用，已从链上重新同步nonce并重试...{Colors.RESET}")
+            elif 'replacement transaction underpriced' in str(e):
+                fees = fee_oracle.replacement_fees(fees)
+                print(f"  {Colors.YELLOW}⚠️ 授权交易Gas价格过低，增加到 {fee_oracle.describe(fees)}并重试...{Colors.RESET}")
+            elif 'out of gas' in str(e) and gas_limit is not None:
+                gas_estimator.bump("approve", token_address, gas_limit)
+                print(f"  {Colors.RED}🔥 交易Gas上限 {gas_limit} 不足，已提高Gas上限并重试...{Colors.RESET}")
             else:
                 print(f"  {Colors.RED}❌ 授权过程中发生错误: {e}{Colors.RESET}")
                 return False
 
-def swap_tokens_for_eth(account, private_key, amount_in_token_wei, amount_out_min_eth, deadline, token_address_to_swap):
-    path = [web3.to_checksum_address(token_address_to_swap), web3.to_checksum_address(WETH_ADDRESS)]
+def swap_tokens_for_eth(account, private_key, amount_in_token_wei, amount_out_min_eth, token_address_to_swap):
+    path = [token_address_to_swap, WETH_ADDRESS]
 
-    gas_price = web3.eth.gas_price
+    fees = fee_oracle.fees()
 
+    expired = False
     while True:
+        nonce = None
+        tx_hash = None
+        gas_limit = None
         try:
-            nonce = web3.eth.get_transaction_count(account.address, "pending")
-
-            transaction = uniswap_router.functions.swapExactTokensForETH(
-                amount_in_token_wei,
-                amount_out_min_eth,
-                path,
-                account.address,
-                deadline
-            ).build_transaction({
+            nonce = nonce_manager.allocate(account.address)
+
+            call = {
                 'from': account.address,
+                'to': UNISWAP_V2_ROUTER_ADDRESS,
                 'value': 0,
-                'gas': 270000,
-                'gasPrice': gas_price,
+                'data': calldata.encode("swapExactTokensForETH", amount_in_token_wei, amount_out_min_eth, path, account.address, block_clock.deadline())
+            }
+            gas_limit = gas_estimator.limit("swap_tokens_for_eth", token_address_to_swap, lambda: web3.eth.estimate_gas(call), 270000)
+            transaction = {
+                **call,
+                'gas': gas_limit,
+                **fees,
                 'nonce': nonce,
                 'chainId': CHAIN_ID
-            })
+            }
 
-            signed_txn = web3.eth.account.sign_transaction(transaction, private_key=private_key)
-            tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction)
+            raw_transaction = signer.sign(transaction, private_key)
+            tx_hash = web3.eth.send_raw_transaction(raw_transaction)
+            nonce_manager.sent(account.address, nonce, tx_hash)
+            receipt_tracker.track(tx_hash, gas_estimator.receipt_callback("swap_tokens_for_eth", token_address_to_swap, gas_limit))
+            allowance_ledger.record_spend(account.address, token_address_to_swap, UNISWAP_V2_ROUTER_ADDRESS, amount_in_token_wei)
             print(f"  {Colors.GREEN}✅ {Colors.BOLD}交易已发送{Colors.RESET}")
             return web3.to_hex(tx_hash)
 
         except Exception as e:
-            if 'replacement transaction underpriced' in str(e) or 'nonce too low' in str(e):
-                gas_price += web3.to_wei(2, 'gwei')
-                print(f"  {Colors.YELLOW}⚠️ Gas价格过低或nonce问题，增加到 {web3.from_wei(gas_price, 'gwei')} gwei并重试...{Colors.RESET}")
-            elif 'out of gas' in str(e):
-                gas_price += web3.to_wei(5, 'gwei')
-                print(f"  {Colors.RED}🔥 交易Gas不足，增加Gas价格至 {web3.from_wei(gas_price, 'gwei')} gwei并重试...{Colors.RESET}")
+            if tx_hash is None:
+                nonce_manager.handle_send_error(account.address, nonce, e)
+            if 'nonce too low' in str(e):
+                print(f"  {Colors.YELLOW}⚠️ nonce已被占用，已从链上重新同步nonce并重试...{Colors.RESET}")
+            elif 'replacement transaction underpriced' in str(e):
+                fees = fee_oracle.replacement_fees(fees)
+                print(f"  {Colors.YELLOW}⚠️ Gas价格过低，增加到 {fee_oracle.describe(fees)}并重试...{Colors.RESET}")
+            elif 'out of gas' in str(e) and gas_limit is not None:
+                gas_estimator.bump("swap_tokens_for_eth", token_address_to_swap, gas_limit)
+                print(f"  {Colors.RED}🔥 交易Gas上限 {gas_limit} 不足，已提高Gas上限并重试...{Colors.RESET}")
+            elif 'EXPIRED' in str(e) and not expired:
+                expired = True
+                block_clock.refresh()
+                print(f"  {Colors.YELLOW}⚠️ 交易已过截止时间，已重新读取最新区块时间并重试...{Colors.RESET}")
             else:
                 print(f"  {Colors.RED}❌ 交易过程中发生错误: {e}{Colors.RESET}")
                 raise
 
-if __name__ == "__main__":
+async def approve_token_async(async_web3, account, private_key, token_address, router_address, amount_to_approve):
+    if not await allowance_ledger.needs_approval_async(account.address, token_address, router_address, amount_to_approve, async_web3):
+        print(f"  {Colors.CYAN}ℹ️ 路由器授权额度充足，跳过授权交易。{Colors.RESET}")
+        return True
+    amount_to_approve = allowance_ledger.approval_amount(amount_to_approve)
+    fees = await fee_oracle.fees_async(async_web3)
+
+    while True:
+        nonce = None
+        tx_hash = None
+        gas_limit = None
+        try:
+            nonce = await nonce_manager.allocate_async(account.address, async_web3)
+            print(f"  {Colors.YELLOW}⏳ 账户 {account.address} 正在为Uniswap路由器授权 {from_base_units(amount_to_approve, metadata.decimals(token_address))} {SELECTED_TOKEN_NAME}...{Colors.RESET}")
+
+            call = {
+                'from': account.address,
+                'to': token_address,
+                'value': 0,
+                'data': calldata.encode("approve", router_address, amount_to_approve)
+            }
+            gas_limit = await gas_estimator.limit_async("approve", token_address, lambda: async_web3.eth.estimate_gas(call), 120000)
+            transaction = {
+                **call,
+                'gas': gas_limit,
+                **fees,
+                'nonce': nonce,
+                'chainId': CHAIN_ID
+            }
+
+            raw_transaction = await signer.sign_async(transaction, private_key)
+            tx_hash = await async_web3.eth.send_raw_transaction(raw_transaction)
+            nonce_manager.sent(account.address, nonce, tx_hash)
+            print(f"  {Colors.GREEN}✅ {Colors.BOLD}授权交易已发送{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{web3.to_hex(tx_hash)}{Colors.RESET}")
+            receipt = await receipt_tracker.wait_async(tx_hash, timeout=300)
+            gas_estimator.record("approve", token_address, receipt, gas_limit)
+            allowance_ledger.record_approval(account.address, token_address, router_address, amount_to_approve)
+            print(f"{Colors.GREEN}  🎉 账户 {account.address} 授权确认成功!{Colors.RESET}")
+            return True
+
+        except Exception as e:
+            if tx_hash is None:
+                await nonce_manager.handle_send_error_async(account.address, nonce, e, async_web3)
+            if 'nonce too low' in str(e):
+                print(f"  {Colors.YELLOW}⚠️ nonce已被占用，已从链上重新同步nonce并重试...{Colors.RESET}")
+            elif 'replacement transaction underpriced' in str(e):
+                fees = await fee_oracle.replacement_fees_async(fees, async_web3)
+                print(f"  {Colors.YELLOW}⚠️ 授权交易Gas价格过低，增加到 {fee_oracle.describe(fees)}并重试...{Colors.RESET}")
+            elif 'out of gas' in str(e) and gas_limit is not None:
+                gas_estimator.bump("approve", token_address, gas_limit)
+                print(f"  {Colors.RED}🔥 交易Gas上限 {gas_limit} 不足，已提高Gas上限并重试...{Colors.RESET}")
+            else:
+                print(f"  {Colors.RED}❌ 账户 {account.address} 授权过程中发生错误: {e}{Colors.RESET}")
+                return False
+
+async def swap_tokens_for_eth_async(async_web3, account, private_key, amount_in_token_wei, amount_out_min_eth, token_address_to_swap):
+    path = [token_address_to_swap, WETH_ADDRESS]
+
+    fees = await fee_oracle.fees_async(async_web3)
+
+    expired = False
+    while True:
+        nonce = None
+        tx_hash = None
+        gas_limit = None
+        try:
+            nonce = await nonce_manager.allocate_async(account.address, async_web3)
+
+            call = {
+                'from': account.address,
+                'to': UNISWAP_V2_ROUTER_ADDRESS,
+                'value': 0,
+                'data': calldata.encode("swapExactTokensForETH", amount_in_token_wei, amount_out_min_eth, path, account.address, block_clock.deadline())
+            }
+            gas_limit = await gas_estimator.limit_async("swap_tokens_for_eth", token_address_to_swap, lambda: async_web3.eth.estimate_gas(call), 270000)
+            transaction = {
+                **call,
+                'gas': gas_limit,
+                **fees,
+                'nonce': nonce,
+                'chainId': CHAIN_ID
+            }
+
+            raw_transaction = await signer.sign_async(transaction, private_key)
+            tx_hash = await async_web3.eth.send_raw_transaction(raw_transaction)
+            nonce_manager.sent(account.address, nonce, tx_hash)
+            receipt_tracker.track(tx_hash, gas_estimator.receipt_callback("swap_tokens_for_eth", token_address_to_swap, gas_limit))
+            allowance_ledger.record_spend(account.address, token_address_to_swap, UNISWAP_V2_ROUTER_ADDRESS, amount_in_token_wei)
+            print(f"  {Colors.GREEN}✅ {Colors.BOLD}账户 {account.address} 交易已发送{Colors.RESET}")
+            return web3.to_hex(tx_hash)
+
+        except Exception as e:
+            if tx_hash is None:
+                await nonce_manager.handle_send_error_async(account.address, nonce, e, async_web3)
+            if 'nonce too low' in str(e):
+                print(f"  {Colors.YELLOW}⚠️ nonce已被占用，已从链上重新同步nonce并重试...{Colors.RESET}")
+            elif 'replacement transaction underpriced' in str(e):
+                fees = await fee_oracle.replacement_fees_async(fees, async_web3)
+                print(f"  {Colors.YELLOW}⚠️ Gas价格过低，增加到 {fee_oracle.describe(fees)}并重试...{Colors.RESET}")
+            elif 'out of gas' in str(e) and gas_limit is not None:
+                gas_estimator.bump("swap_tokens_for_eth", token_address_to_swap, gas_limit)
+                print(f"  {Colors.RED}🔥 交易Gas上限 {gas_limit} 不足，已提高Gas上限并重试...{Colors.RESET}")
+            elif 'EXPIRED' in str(e) and not expired:
+                expired = True
+                await block_clock.refresh_async()
+                print(f"  {Colors.YELLOW}⚠️ 交易已过截止时间，已重新读取最新区块时间并重试...{Colors.RESET}")
+            else:
+                print(f"  {Colors.RED}❌ 账户 {account.address} 交易过程中发生错误: {e}{Colors.RESET}")
+                raise
+
+def main():
+    global SELECTED_TOKEN_NAME, TOKEN_ADDRESS, TOKEN_DECIMALS
+    warm_up()
     print(f"{Colors.BOLD}{Colors.MAGENTA}--- 🔄 Nexswap代币兑换NEX工具 🔄 ---{Colors.RESET}")
 
     print(f"\n{Colors.BOLD}{Colors.BLUE}--- 选择要兑换为NEX的代币 ---{Colors.RESET}")
@@ -184,6 +268,7 @@ if __name__ == "__main__":
             if 1 <= choice <= len(token_names):
                 SELECTED_TOKEN_NAME = token_names[choice - 1]
                 TOKEN_ADDRESS = AVAILABLE_TOKENS[SELECTED_TOKEN_NAME]
+                TOKEN_DECIMALS = metadata.decimals(TOKEN_ADDRESS)
                 print(f"{Colors.GREEN}✅ 您选择了: {Colors.BOLD}{SELECTED_TOKEN_NAME}{Colors.RESET}")
                 break
             else:
@@ -200,7 +285,7 @@ if __name__ == "__main__":
             raise ValueError("无效的代币范围。请确保输入正值且最小值不大于最大值。")
     except ValueError as e:
         print(f"{Colors.RED}错误: {e}{Colors.RESET}")
-        exit()
+        return
 
     run_in_loop = False
     while True:
@@ -216,96 +301,122 @@ if __name__ == "__main__":
         else:
             print(f"{Colors.RED}无效选择，请输入'y'或'n'。{Colors.RESET}")
 
+    concurrency = 0
+    while True:
+        mode_choice = input(f"{Colors.CYAN}选择执行模式:\n1. 顺序模式(逐个账户)\n2. 并发模式(多个账户同时执行)\n选择模式 (1或2): {Colors.RESET}").strip()
+        if mode_choice == '1':
+            print(f"{Colors.GREEN}✅ 顺序模式已选择，同时最多执行 {MAX_INFLIGHT} 个步骤(可用--max-inflight调整)，钱包等待期间执行其他钱包。{Colors.RESET}")
+            break
+        elif mode_choice == '2':
+            try:
+                concurrency = int(input(f"{Colors.CYAN}输入最大并发钱包数量(例如: 10): {Colors.RESET}"))
+                if concurrency < 1:
+                    raise ValueError("并发数量必须至少为1。")
+                print(f"{Colors.GREEN}✅ 并发模式已选择，最多同时执行 {concurrency} 个钱包。{Colors.RESET}")
+                break
+            except ValueError as e:
+                print(f"{Colors.RED}无效输入: {e}{Colors.RESET}")
+        else:
+            print(f"{Colors.RED}无效选择，请输入'1'或'2'。{Colors.RESET}")
+
     amount_out_min_eth = 0
 
-    deadline = int(web3.eth.get_block('latest').timestamp) + 300
+    accounts = wallet_index.accounts()
 
-    accounts = [web3.eth.account.from_key(pk) for pk in PRIVATE_KEYS]
-    account_index = 0
+    balance_snapshot = None
 
-    print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 开始代币兑换NEX操作 ---{Colors.RESET}")
+    def take_balance_snapshot():
+        try:
+            snapshot = batch_reader.snapshot([account.address for account in accounts], [TOKEN_ADDRESS], [UNISWAP_V2_ROUTER_ADDRESS])
+            allowance_ledger.load_snapshot(snapshot)
+            return snapshot
+        except Exception as e:
+            print(f"  {Colors.YELLOW}⚠️ 批量读取余额失败: {e}，将逐个查询余额。{Colors.RESET}")
+            return None
 
-    if run_in_loop:
-        while True:
-            try:
-                current_account = accounts[account_index]
-                current_private_key = PRIVATE_KEYS[account_index]
+    def get_snapshot_token_balance(account, token_address):
+        if balance_snapshot is not None:
+            return balance_snapshot.token_balance(account.address, token_address)
+        return get_token_balance(account.address, token_address)
 
-                token_amount = round(random.uniform(min_token_amount, max_token_amount), 4)
-                amount_in_token_wei = web3.to_wei(token_amount, 'ether')
+    print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 开始代币兑换NEX操作 ---{Colors.RESET}")
 
-                print(f"\n{Colors.WHITE}🔄 {Colors.BOLD}正在为账户准备兑换:{Colors.RESET}{Colors.WHITE} {current_account.address}{Colors.RESET}")
-                print(f"{Colors.WHITE}   正在尝试将 {Colors.BOLD}{token_amount} {SELECTED_TOKEN_NAME}{Colors.RESET}{Colors.WHITE} 兑换为NEX...{Colors.RESET}")
+    if concurrency > 0:
+        async_web3 = create_async_web3(transport, concurrency)
+        async_token = async_web3.eth.contract(address=TOKEN_ADDRESS, abi=ERC20_ABI)
 
-                current_token_balance_wei = get_token_balance(current_account.address, TOKEN_ADDRESS)
-                current_token_balance = web3.from_wei(current_token_balance_wei, 'ether')
+        async def unswap_wallet(account, private_key):
+            token_amount = round(random.uniform(min_token_amount, max_token_amount), 4)
+            amount_in_token_wei = to_base_units(token_amount, TOKEN_DECIMALS)
 
-                if current_token_balance_wei < amount_in_token_wei:
-                    print(f"  {Colors.RED}❌ {Colors.BOLD}账户 {current_account.address} 的{SELECTED_TOKEN_NAME}余额不足{Colors.RESET}{Colors.RED}。余额: {current_token_balance} {SELECTED_TOKEN_NAME}。跳过到下一个账户。{Colors.RESET}")
-                    account_index = (account_index + 1) % len(accounts)
-                    time.sleep(1)
-                    continue
+            print(f"\n{Colors.WHITE}🔄 {Colors.BOLD}正在为账户准备兑换:{Colors.RESET}{Colors.WHITE} {account.address} ({token_amount} {SELECTED_TOKEN_NAME} → NEX){Colors.RESET}")
 
-                if not approve_token(current_account, current_private_key, TOKEN_ADDRESS, UNISWAP_V2_ROUTER_ADDRESS, amount_in_token_wei):
-                    print(f"  {Colors.RED}❌ 无法为账户 {current_account.address} 授权代币。跳过此兑换。{Colors.RESET}")
-                    account_index = (account_index + 1) % len(accounts)
-                    time.sleep(1)
-                    continue
+            if balance_snapshot is not None:
+                token_balance_wei = balance_snapshot.token_balance(account.address, TOKEN_ADDRESS)
+            else:
+                token_balance_wei = await async_token.functions.balanceOf(account.address).call()
+            if token_balance_wei < amount_in_token_wei:
+                print(f"  {Colors.RED}❌ {Colors.BOLD}账户 {account.address} 的{SELECTED_TOKEN_NAME}余额不足{Colors.RESET}{Colors.RED}。余额: {from_base_units(token_balance_wei, TOKEN_DECIMALS)} {SELECTED_TOKEN_NAME}。跳过此账户。{Colors.RESET}")
+                return False
 
-                tx_hash = swap_tokens_for_eth(current_account, current_private_key, amount_in_token_wei, amount_out_min_eth, deadline, TOKEN_ADDRESS)
-                print(f"{Colors.GREEN}  🎉 {Colors.BOLD}成功将 {token_amount} {SELECTED_TOKEN_NAME} 兑换为NEX{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{tx_hash}{Colors.RESET}")
+            if not await approve_token_async(async_web3, account, private_key, TOKEN_ADDRESS, UNISWAP_V2_ROUTER_ADDRESS, amount_in_token_wei):
+                print(f"  {Colors.RED}❌ 无法为账户 {account.address} 授权代币。跳过此兑换。{Colors.RESET}")
+                return False
 
-                delay = random.randint(5, 15)
-                print(f"{Colors.YELLOW}  😴 等待 {delay} 秒后进行下一笔交易...{Colors.RESET}")
-                time.sleep(delay)
+            tx_hash = await swap_tokens_for_eth_async(async_web3, account, private_key, amount_in_token_wei, amount_out_min_eth, TOKEN_ADDRESS)
+            print(f"{Colors.GREEN}  🎉 {Colors.BOLD}账户 {account.address} 成功将 {token_amount} {SELECTED_TOKEN_NAME} 兑换为NEX{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{tx_hash}{Colors.RESET}")
+            return True
 
-                account_index = (account_index + 1) % len(accounts)
+        def start_round():
+            nonlocal balance_snapshot
+            balance_snapshot = take_balance_snapshot()
 
-            except Exception as e:
-                print(f"  {Colors.RED}❌ 账户 {accounts[account_index].address} 发生意外错误: {e}{Colors.RESET}")
-                print(f"{Colors.YELLOW}  短暂暂停后将转到下一个账户...{Colors.RESET}")
-                account_index = (account_index + 1) % len(accounts)
-                time.sleep(5)
+        AsyncWalletExecutor(concurrency, 5, 15).run(accounts, PRIVATE_KEYS, unswap_wallet, run_in_loop, start_round)
+        if not run_in_loop:
+            print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 所有单次执行兑换已完成。 ---{Colors.RESET}")
     else:
-        for i in range(len(accounts)):
+        def unswap_steps(position):
+            # 一个钱包一轮的步骤，等待时yield间隔秒数，由调度器在此期间执行其他钱包
+            current_account = accounts[position]
             try:
-                current_account = accounts[account_index]
-                current_private_key = PRIVATE_KEYS[account_index]
+                current_private_key = PRIVATE_KEYS[position]
 
                 token_amount = round(random.uniform(min_token_amount, max_token_amount), 4)
-                amount_in_token_wei = web3.to_wei(token_amount, 'ether')
+                amount_in_token_wei = to_base_units(token_amount, TOKEN_DECIMALS)
 
                 print(f"\n{Colors.WHITE}🔄 {Colors.BOLD}正在为账户准备兑换:{Colors.RESET}{Colors.WHITE} {current_account.address}{Colors.RESET}")
                 print(f"{Colors.WHITE}   正在尝试将 {Colors.BOLD}{token_amount} {SELECTED_TOKEN_NAME}{Colors.RESET}{Colors.WHITE} 兑换为NEX...{Colors.RESET}")
 
-                current_token_balance_wei = get_token_balance(current_account.address, TOKEN_ADDRESS)
-                current_token_balance = web3.from_wei(current_token_balance_wei, 'ether')
+                current_token_balance_wei = get_snapshot_token_balance(current_account, TOKEN_ADDRESS)
+                current_token_balance = from_base_units(current_token_balance_wei, TOKEN_DECIMALS)
 
                 if current_token_balance_wei < amount_in_token_wei:
                     print(f"  {Colors.RED}❌ {Colors.BOLD}账户 {current_account.address} 的{SELECTED_TOKEN_NAME}余额不足{Colors.RESET}{Colors.RED}。余额: {current_token_balance} {SELECTED_TOKEN_NAME}。跳过到下一个账户。{Colors.RESET}")
-                    account_index = (account_index + 1) % len(accounts)
-                    time.sleep(1)
-                    continue
+                    return False
 
                 if not approve_token(current_account, current_private_key, TOKEN_ADDRESS, UNISWAP_V2_ROUTER_ADDRESS, amount_in_token_wei):
                     print(f"  {Colors.RED}❌ 无法为账户 {current_account.address} 授权代币。跳过此兑换。{Colors.RESET}")
-                    account_index = (account_index + 1) % len(accounts)
-                    time.sleep(1)
-                    continue
+                    return False
 
-                tx_hash = swap_tokens_for_eth(current_account, current_private_key, amount_in_token_wei, amount_out_min_eth, deadline, TOKEN_ADDRESS)
+                tx_hash = swap_tokens_for_eth(current_account, current_private_key, amount_in_token_wei, amount_out_min_eth, TOKEN_ADDRESS)
                 print(f"{Colors.GREEN}  🎉 {Colors.BOLD}成功将 {token_amount} {SELECTED_TOKEN_NAME} 兑换为NEX{Colors.RESET}{Colors.GREEN} https://testnet3.explorer.nexus.xyz/tx/{tx_hash}{Colors.RESET}")
+            except Exception as e:
+                print(f"  {Colors.RED}❌ 账户 {current_account.address} 发生意外错误: {e}{Colors.RESET}")
+                return False
 
-                if i < len(accounts) - 1:
-                    delay = random.randint(5, 15)
-                    print(f"{Colors.YELLOW}  😴 等待 {delay} 秒后进行下一笔交易...{Colors.RESET}")
-                    time.sleep(delay)
+            if run_in_loop:
+                delay = random.randint(5, 15)
+                print(f"{Colors.YELLOW}  😴 账户 {current_account.address} 等待 {delay} 秒后进行下一笔交易...{Colors.RESET}")
+                yield delay
+            return True
 
-                account_index = (account_index + 1) % len(accounts)
+        def start_round():
+            nonlocal balance_snapshot
+            balance_snapshot = take_balance_snapshot()
 
-            except Exception as e:
-                print(f"  {Colors.RED}❌ 账户 {accounts[account_index].address} 发生意外错误: {e}{Colors.RESET}")
-                print(f"{Colors.YELLOW}  短暂暂停后将转到下一个账户...{Colors.RESET}")
-                account_index = (account_index + 1) % len(accounts)
-                time.sleep(5)
-        print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 所有单次执行兑换已完成。 ---{Colors.RESET}")
+        StepScheduler(MAX_INFLIGHT).run(len(accounts), unswap_steps, run_in_loop, start_round)
+        if not run_in_loop:
+            print(f"\n{Colors.BOLD}{Colors.MAGENTA}--- 所有单次执行兑换已完成。 ---{Colors.RESET}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import asyncio
+import random
+import time
+from colorama import Fore, Style
+
+# 并发执行模式: 同时为多个钱包执行操作，每个钱包保留自己的随机间隔
+
+MAX_SCHEDULED_WALLETS = 2000
+
+def create_async_web3(transport, concurrency=None):
+    # transport: 与同步客户端共享的transport.EndpointPool，也可以直接传RPC URL；
+    # concurrency: 并发钱包数，每个钱包同一时间只有一个请求，发送请求的线程数按它设置，不受asyncio默认线程池大小的限制
+    from web3 import AsyncWeb3
+    if isinstance(transport, str):
+        return AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(transport))
+    from transport import AsyncFailoverHTTPProvider
+    return AsyncWeb3(AsyncFailoverHTTPProvider(transport, max_workers=concurrency))
+
+def report_round_time(mode_name, round_number, elapsed, wallet_count):
+    per_wallet = elapsed / wallet_count if wallet_count else 0
+    print(f"\n{Fore.MAGENTA}{Style.BRIGHT}⏱️ [{mode_name}] 第 {round_number} 轮完成: {wallet_count} 个钱包, 耗时 {elapsed:.2f} 秒 (平均每个钱包 {per_wallet:.2f} 秒){Style.RESET_ALL}")
+
+class AsyncWalletExecutor:
+    def __init__(self, concurrency=10, min_delay=5, max_delay=15):
+        if concurrency < 1:
+            raise ValueError("并发数量必须至少为1")
+        if min_delay < 0 or min_delay > max_delay:
+            raise ValueError("无效的等待时间范围")
+        self.concurrency = int(concurrency)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    async def _run_wallet(self, semaphore, account, private_key, task, with_delay):
+        # 只在执行交易时占用并发名额，等待期间把名额让给其他钱包
+        async with semaphore:
+            try:
+                result = await task(account, private_key)
+            except Exception as e:
+                print(f"  {Fore.RED}❌ 账户 {account.address} 执行过程中发生意外错误: {e}{Style.RESET_ALL}")
+                result = None
+
+        if with_delay:
+            delay = random.randint(self.min_delay, self.max_delay)
+            print(f"{Fore.YELLOW}  😴 账户 {account.address} 等待 {delay} 秒后进行下一笔交易...{Style.RESET_ALL}")
+            await asyncio.sleep(delay)
+        return result
+
+    async def run_round(self, accounts, private_keys, task, with_delay=True):
+        # 最多同时调度MAX_SCHEDULED_WALLETS个钱包，钱包很多时不会一次创建所有任务
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+        results = []
+        scheduled = set()
+        for position in range(len(accounts)):
+            if len(scheduled) >= MAX_SCHEDULED_WALLETS:
+                done, scheduled = await asyncio.wait(scheduled, return_when=asyncio.FIRST_COMPLETED)
+                results.extend(task_done.result() for task_done in done)
+            scheduled.add(asyncio.ensure_future(self._run_wallet(semaphore, accounts[position], private_keys[position], task, with_delay)))
+        if scheduled:
+            done, _ = await asyncio.wait(scheduled)
+            results.extend(task_done.result() for task_done in done)
+        return results, time.perf_counter() - start
+
+    def run(self, accounts, private_keys, task, run_in_loop=False, before_round=None):
+        async def _main():
+            round_number = 0
+            while True:
+                round_number += 1
+                # 每轮开始前没有其他任务在运行，例如批量读取本轮所有钱包的余额
+                if before_round is not None:
+                    before_round()
+                results, elapsed = await self.run_round(accounts, private_keys, task, with_delay=run_in_loop)
+                succeeded = sum(1 for result in results if result)
+                print(f"{Fore.GREEN}✅ 本轮成功 {succeeded}/{len(accounts)} 个钱包{Style.RESET_ALL}")
+                report_round_time(f"并发x{self.concurrency}", round_number, elapsed, len(accounts))
+                if not run_in_loop:
+                    break
+
+        asyncio.run(_main())
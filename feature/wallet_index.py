@@ -0,0 +1,156 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from eth_utils import to_checksum_address
+from metadata import CACHE_DIR
+from wallets import WalletSet
+
+# 钱包地址索引: 第一次启动时用多个进程并行从私钥推导地址，
+# 把"私钥指纹→地址"记录保存到本地缓存(不保存私钥)，之后启动直接读取缓存，不再重复推导
+
+PARALLEL_THRESHOLD = 512
+DERIVE_CHUNK_SIZE = 1024
+DERIVE_BATCH_SIZE = 65536
+FINGERPRINT_SIZE = 16
+RECORD_SIZE = FINGERPRINT_SIZE + 20
+
+def key_bytes(private_key):
+    if isinstance(private_key, (bytes, bytearray)):
+        return bytes(private_key)
+    return bytes.fromhex(private_key[2:] if private_key.startswith("0x") else private_key)
+
+def fingerprint(private_key):
+    # 单向哈希，缓存文件泄露也无法还原私钥
+    return hashlib.blake2b(key_bytes(private_key), digest_size=FINGERPRINT_SIZE, person=b"wallet-index").digest()
+
+def derive_addresses(private_keys):
+    from eth_keys import keys
+    return [keys.PrivateKey(key_bytes(private_key)).public_key.to_checksum_address() for private_key in private_keys]
+
+class WalletIndex:
+    def __init__(self, private_keys, cache_path=None, workers=None):
+        # private_keys: 私钥列表或wallets.KeyView；每个钱包在内存中只占一条36字节的(指纹, 地址)记录
+        self.private_keys = private_keys
+        self.cache_path = cache_path or os.path.join(CACHE_DIR, "wallets.bin")
+        self.workers = workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._packed = None
+
+    def __len__(self):
+        return len(self.private_keys)
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return b""
+        try:
+            with open(self.cache_path, "rb") as f:
+                return f.read()
+        except OSError:
+            return b""
+
+    def _save_cache(self, records):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(records)
+        os.replace(tmp_path, self.cache_path)
+
+    def _derive(self, private_keys, executor):
+        if executor is None:
+            return derive_addresses(private_keys)
+        chunks = [private_keys[start:start + DERIVE_CHUNK_SIZE] for start in range(0, len(private_keys), DERIVE_CHUNK_SIZE)]
+        return [address for chunk in executor.map(derive_addresses, chunks) for address in chunk]
+
+    def _build(self):
+        source = getattr(self.private_keys, "source", None)
+        if source is not None and source.has_addresses:
+            # keystore文件自带地址，不需要解密私钥来推导
+            return None
+        # 缓存按上次的私钥顺序保存(指纹, 地址)记录，私钥顺序没变时逐条比对即可，不需要建立字典
+        cache = self._load_cache()
+        cached_count = len(cache) // RECORD_SIZE
+        records = bytearray(RECORD_SIZE * len(self.private_keys))
+        missing = []
+        for position, private_key in enumerate(self.private_keys):
+            value = fingerprint(private_key)
+            offset = RECORD_SIZE * position
+            if position < cached_count and cache[offset:offset + FINGERPRINT_SIZE] == value:
+                records[offset:offset + RECORD_SIZE] = cache[offset:offset + RECORD_SIZE]
+            else:
+                records[offset:offset + FINGERPRINT_SIZE] = value
+                missing.append(position)
+
+        if missing:
+            # 私钥顺序变化或新增私钥时，先按指纹在旧缓存中查找，找不到的再推导
+            known = {cache[offset:offset + FINGERPRINT_SIZE]: cache[offset + FINGERPRINT_SIZE:offset + RECORD_SIZE] for offset in range(0, RECORD_SIZE * cached_count, RECORD_SIZE)}
+            unknown = []
+            for position in missing:
+                offset = RECORD_SIZE * position
+                address = known.get(bytes(records[offset:offset + FINGERPRINT_SIZE]))
+                if address is None:
+                    unknown.append(position)
+                else:
+                    records[offset + FINGERPRINT_SIZE:offset + RECORD_SIZE] = address
+            del known
+            executor = None
+            if len(unknown) >= PARALLEL_THRESHOLD and self.workers > 1:
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                # 分批读取私钥，避免一次把所有缺少的私钥都放进内存
+                for start in range(0, len(unknown), DERIVE_BATCH_SIZE):
+                    batch = unknown[start:start + DERIVE_BATCH_SIZE]
+                    derived = self._derive([self.private_keys[position] for position in batch], executor)
+                    for position, address in zip(batch, derived):
+                        offset = RECORD_SIZE * position + FINGERPRINT_SIZE
+                        records[offset:offset + 20] = bytes.fromhex(address[2:])
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            self._save_cache(records)
+        return records
+
+    def load(self):
+        with self._lock:
+            if self._packed is None:
+                self._packed = self._build() or b""
+        return self
+
+    def address_bytes(self, position):
+        self.load()
+        if not self._packed:
+            return bytes.fromhex(self.private_keys.source.address_hint(position)[2:])
+        offset = RECORD_SIZE * position + FINGERPRINT_SIZE
+        return bytes(self._packed[offset:offset + 20])
+
+    def address(self, position):
+        return to_checksum_address(self.address_bytes(position))
+
+    def accounts(self):
+        # 返回按需创建钱包记录的序列，account.address与原来的LocalAccount用法相同
+        self.load()
+        return WalletSet(self)
+
+def benchmark(count=20000):
+    # 比较逐个推导、并行推导和读取缓存的启动耗时
+    import tempfile
+    private_keys = ["0x" + os.urandom(32).hex() for _ in range(count)]
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "wallets.bin")
+        start = time.perf_counter()
+        derive_addresses(private_keys)
+        print(f"逐个推导 {count} 个地址: {time.perf_counter() - start:.2f} 秒")
+
+        start = time.perf_counter()
+        WalletIndex(private_keys, cache_path).load()
+        print(f"首次启动(并行推导并写入缓存): {time.perf_counter() - start:.2f} 秒")
+
+        start = time.perf_counter()
+        index = WalletIndex(private_keys, cache_path).load()
+        print(f"再次启动(读取缓存): {time.perf_counter() - start:.2f} 秒")
+        assert [index.address(position) for position in range(100)] == derive_addresses(private_keys[:100])
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from eth_utils import to_checksum_address
+
+# 钱包来源: 私钥可以来自.env的PRIVATE_KEYS、每行一个私钥的文件或加密的keystore目录。
+# 文件和keystore只在启动时流式扫描一遍并记录位置，私钥在钱包被调度时才读取，
+# 钱包对象也只在用到时创建，十万个钱包时内存占用也保持在较低水平
+
+RECORD_CACHE_SIZE = 4096
+DECRYPTED_KEY_CACHE_SIZE = 4096  # keystore解密很慢，最近用到的私钥保留在大小固定的缓存中
+READ_CHUNK_SIZE = 1 << 20
+
+def _normalize_key(key):
+    key = key.strip()
+    return key if key.startswith("0x") else "0x" + key
+
+class EnvWalletSource:
+    has_addresses = False
+
+    def __init__(self, private_keys):
+        self.private_keys = [_normalize_key(key) for key in private_keys if key.strip()]
+
+    def __len__(self):
+        return len(self.private_keys)
+
+    def load_key(self, index):
+        return self.private_keys[index]
+
+    def iter_keys(self):
+        return iter(self.private_keys)
+
+class FileWalletSource:
+    # 每行一个私钥，空行和#开头的行会被忽略；启动时只记录每个私钥所在的字节位置
+    has_addresses = False
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = array("Q")
+        self._lock = threading.Lock()
+        self._file = None
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                stripped = line.strip()
+                if stripped and not stripped.startswith(b"#"):
+                    self.offsets.append(offset)
+                offset += len(line)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def load_key(self, index):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            self._file.seek(self.offsets[index])
+            return _normalize_key(self._file.readline().decode())
+
+    def iter_keys(self):
+        # 顺序读取整个文件时不逐行seek，按块流式读取
+        with open(self.path, "rb", buffering=READ_CHUNK_SIZE) as f:
+            for line in f:
+                stripped = line.strip()
+                if stripped and not stripped.startswith(b"#"):
+                    yield _normalize_key(stripped.decode())
+
+class KeystoreWalletSource:
+    # 加密keystore目录，每个文件一个钱包；地址直接从keystore文件读取，私钥在第一次签名前才解密
+    has_addresses = True
+
+    def __init__(self, directory, password):
+        self.directory = directory
+        self.password = password
+        self.names = sorted(name for name in os.listdir(directory) if not name.startswith("."))
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _read(self, index):
+        with open(os.path.join(self.directory, self.names[index]), "r") as f:
+            return json.load(f)
+
+    def load_key(self, index):
+        with self._lock:
+            key = self._keys.get(index)
+            if key is not None:
+                self._keys.move_to_end(index)
+        if key is None:
+            from eth_account import Account
+            key = bytes(Account.decrypt(self._read(index), self.password))
+            with self._lock:
+                self._keys[index] = key
+                if len(self._keys) > DECRYPTED_KEY_CACHE_SIZE:
+                    self._keys.popitem(last=False)
+        return "0x" + key.hex()
+
+    def iter_keys(self):
+        for index in range(len(self)):
+            yield self.load_key(index)
+
+    def address_hint(self, index):
+        address = self._read(index)["address"]
+        return address if address.startswith("0x") else "0x" + address
+
+def open_wallet_source(private_keys_env, wallet_file=None, keystore_dir=None, keystore_password=""):
+    if wallet_file:
+        return FileWalletSource(wallet_file)
+    if keystore_dir:
+        return KeystoreWalletSource(keystore_dir, keystore_password)
+    return EnvWalletSource((private_keys_env or "").split(","))
+
+class KeyView:
+    # 按索引读取私钥的只读序列，脚本中的PRIVATE_KEYS[i]和len(PRIVATE_KEYS)保持不变
+    def __init__(self, source):
+        self.source = source
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.source.load_key(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("钱包索引超出范围")
+        return self.source.load_key(index)
+
+    def __iter__(self):
+        return self.source.iter_keys()
+
+class WalletRecord:
+    # 只保存地址和私钥在来源中的位置，私钥本身在签名时才从来源读取；
+    # 校验和地址在创建时计算一次，脚本中频繁读取account.address不再重复计算keccak
+    __slots__ = ("address_bytes", "address", "key_handle")
+
+    def __init__(self, address_bytes, key_handle):
+        self.address_bytes = address_bytes
+        self.address = to_checksum_address(address_bytes)
+        self.key_handle = key_handle
+
+class WalletSet:
+    # 按需创建WalletRecord的只读序列，最近用到的记录保存在一个大小固定的缓存中
+    def __init__(self, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("钱包索引超出范围")
+        with self._lock:
+            record = self._records.get(position)
+            if record is not None:
+                self._records.move_to_end(position)
+                return record
+        record = WalletRecord(self.index.address_bytes(position), position)
+        with self._lock:
+            self._records[position] = record
+            if len(self._records) > RECORD_CACHE_SIZE:
+                self._records.popitem(last=False)
+        return record
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
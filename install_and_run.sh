@@ -65,6 +65,8 @@ setup_venv() {
         echo -e "${RED}依赖安装失败!${RESET}"
         exit 1
     }
+    # 可选依赖: 更快的交易签名，安装失败时使用eth_account签名
+    "$VENV_DIR/bin/pip" install coincurve >/dev/null 2>&1 || echo -e "${YELLOW}coincurve安装失败，将使用默认签名方式${RESET}"
 }
 
 # 克隆或更新仓库
@@ -1,4 +1,8 @@
+import importlib
 import os
+import subprocess
+import sys
+import time
 from colorama import Fore, Style, init
 
 init(autoreset=True)
@@ -7,7 +11,84 @@ from banner import banner
 
 print(banner)
 
+FEATURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature")
+sys.path.insert(0, FEATURE_DIR)
+
+FEATURES = {
+    "1": "swap",
+    "2": "unswap",
+    "3": "swapunswap",
+    "4": "addliquidity",
+    "5": "removeliquidity",
+    "6": "allfeature",
+}
+
+def run_feature(module_name):
+    # 在当前进程中运行功能: 模块只导入一次，Web3实例、HTTP会话和各种缓存在多次选择之间复用
+    os.system('cls' if os.name == 'nt' else 'clear')
+    try:
+        importlib.import_module(module_name).main()
+    except KeyboardInterrupt:
+        print(Fore.YELLOW + "\n已中断，返回主菜单" + Style.RESET_ALL)
+    except Exception as e:
+        print(Fore.RED + f"[错误] 运行 {module_name} 时发生错误: {e}" + Style.RESET_ALL)
+    try:
+        importlib.import_module("core").report_rpc_stats()
+    except Exception:
+        pass
+
+def measure_import_time(module_name):
+    # 使用python -X importtime测量模块导入的累计耗时(秒)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {FEATURE_DIR!r}); import {module_name}"],
+        capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module_name:
+            return int(parts[1]) / 1e6
+    return float("nan")
+
+def prepare_first_transaction(module_name):
+    # 发送首笔交易之前必须完成的准备: 导入功能模块、连接节点、创建路由合约、加载代币列表并读取第一个钱包的nonce
+    importlib.import_module(module_name)
+    core = importlib.import_module("core")
+    core.web3._resolve()
+    core.uniswap_router._resolve()
+    core.token_registry._resolve()
+    core.nonce_manager.sync(core.wallet_index.address(0))
+
+def benchmark_startup():
+    # 对比首笔交易之前的准备耗时: 旧方式每次启动新解释器并重新完成全部准备，新方式在进程内完成一次后复用
+    root_dir = os.path.dirname(FEATURE_DIR)
+    print(Fore.CYAN + f"{'功能':<16}{'导入耗时':>12}{'旧启动方式':>12}{'进程内首次':>12}{'进程内再次':>12}")
+    for module_name in FEATURES.values():
+        import_time = measure_import_time(module_name)
+
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", f"import sys; sys.path.insert(0, {root_dir!r}); from main import prepare_first_transaction; prepare_first_transaction({module_name!r})"],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        subprocess_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        prepare_first_transaction(module_name)
+        first_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        prepare_first_transaction(module_name)
+        warm_time = time.perf_counter() - start
+
+        print(Fore.WHITE + f"{module_name:<16}{import_time:>11.3f}s{subprocess_time:>11.3f}s{first_time:>11.3f}s{warm_time:>11.3f}s")
+
 def main():
+    # 用户查看菜单时在后台提前导入web3并连接节点
+    try:
+        importlib.import_module("core").warm_up()
+    except Exception as e:
+        print(Fore.RED + f"[错误] 初始化失败: {e}" + Style.RESET_ALL)
+
     while True:
         print(Fore.CYAN + "\n请选择功能:")
         print(Fore.CYAN + "1. 代币兑换(NEX→代币)")
@@ -20,24 +101,8 @@ def main():
 
         pilihan = input(Fore.CYAN + "请输入选项(0-6): " + Style.RESET_ALL)
         
-        if pilihan == "1":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            os.system("python feature/swap.py")
-        elif pilihan == "2":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            os.system("python feature/unswap.py")
-        elif pilihan == "3":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            os.system("python feature/swapunswap.py")
-        elif pilihan == "4":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            os.system("python feature/addliquidity.py")
-        elif pilihan == "5":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            os.system("python feature/removeliquidity.py")
-        elif pilihan == "6":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            os.system("python feature/allfeature.py")
+        if pilihan in FEATURES:
+            run_feature(FEATURES[pilihan])
         elif pilihan == "0":
             print(Fore.RED + "程序已退出" + Style.RESET_ALL)
             break
@@ -45,4 +110,7 @@ def main():
             print(Fore.RED + "[错误] 无效的选项，请输入0-6之间的数字" + Style.RESET_ALL)
 
 if __name__ == "__main__":
-    main()
+    if "--benchmark" in sys.argv[1:]:
+        benchmark_startup()
+    else:
+        main()